@@ -1,5 +1,29 @@
 import argparse
-from lib.augmented_generation import perform_rag, perform_summary, perform_rag_with_citations, perform_question_answering
+from lib.search_client import remote_call
+
+def run_rag(mode, query, limit):
+    """(search results, answer, error) from a running search server, else computed here."""
+
+    try:
+        answer = remote_call("rag", {"query": query, "mode": mode, "limit": limit})
+    except Exception as e:
+        return [], "", str(e)
+
+    if answer is not None:
+        return answer["results"], answer["answer"], answer["error"]
+
+    # Imported only without a server: loading the search code takes seconds.
+    from lib.augmented_generation import perform_rag, perform_summary, perform_rag_with_citations, perform_question_answering
+
+    match mode:
+        case "rag":
+            return perform_rag(query)
+        case "summarize":
+            return perform_summary(query, limit)
+        case "citations":
+            return perform_rag_with_citations(query, limit)
+        case "question":
+            return perform_question_answering(query, limit)
 
 def main():
     parser = argparse.ArgumentParser(description="Retrieval Augmented Generation CLI")
@@ -38,7 +62,7 @@ def main():
         case "rag":
             query = args.query
             print(f"Performing RAG for query: '{query}'")
-            search_results, response, error = perform_rag(query)
+            search_results, response, error = run_rag("rag", query, None)
 
             if error:
                 print(f"\nError: {error}")
@@ -59,7 +83,7 @@ def main():
             query = args.query
             limit = args.limit
             print(f"Performing search and summarize for query: '{query}' (limit={limit})")
-            search_results, summary, error = perform_summary(query, limit)
+            search_results, summary, error = run_rag("summarize", query, limit)
 
             if error:
                 print(f"\nError: {error}")
@@ -80,7 +104,7 @@ def main():
             query = args.query
             limit = args.limit
             print(f"Performing search and citation generation for query: '{query}' (limit={limit})")
-            search_results, answer, error = perform_rag_with_citations(query, limit)
+            search_results, answer, error = run_rag("citations", query, limit)
 
             if error:
                 print(f"\nError: {error}")
@@ -101,7 +125,7 @@ def main():
             question = args.question
             limit = args.limit
             print(f"Performing search to answer question: '{question}' (limit={limit})")
-            search_results, answer, error = perform_question_answering(question, limit)
+            search_results, answer, error = run_rag("question", question, limit)
 
             if error:
                 print(f"\nError: {error}")
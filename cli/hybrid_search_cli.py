@@ -1,7 +1,16 @@
 import argparse
 import json
-from lib.hybrid_search import weighted_search, rrf_search
-from lib.llm_prompt import Llm
+from lib.search_client import remote_call
+
+# The search and LLM modules are imported only when a query runs locally,
+# so forwarding to a running search server skips their import time.
+
+
+def print_degraded_legs(legs):
+
+    for name, leg in legs.items():
+        if leg["status"] != "ok":
+            print(f"Warning: {name} leg {leg['status']}, results come from the other leg only\n")
 
 
 def main():
@@ -53,8 +62,20 @@ def main():
     args = parser.parse_args()
 
     if args.command == "weighted-search":
-        results = weighted_search(args.query, args.alpha, args.limit)
+        try:
+            answer = remote_call("weighted", {"query": args.query, "alpha": args.alpha, "limit": args.limit})
+        except Exception as e:
+            print(e)
+            return
+
+        legs = {}
+        if answer is not None:
+            results, legs = answer["results"], answer["legs"]
+        else:
+            from lib.hybrid_search import weighted_search
+            results = weighted_search(args.query, args.alpha, args.limit, legs = legs)
         print(f"Weighted search results for: {args.query} (alpha={args.alpha})\n")
+        print_degraded_legs(legs)
         for i, curr_res in enumerate(results, 1):
             doc_snippet = curr_res["document"].split("\n")[0][:100]
             print(f"{i}. {curr_res['title']}")
@@ -65,15 +86,29 @@ def main():
             print(f"   {doc_snippet}...")
 
     if args.command == "rrf-search":
-        results = rrf_search(
-            args.query,
-            args.k,
-            args.limit,
-            args.enhance,
-            args.rerank_method,
-        )
+        try:
+            answer = remote_call("rrf", {"query": args.query, "k": args.k, "limit": args.limit,
+                                         "enhance": args.enhance, "rerank": args.rerank_method})
+        except Exception as e:
+            print(e)
+            return
+
+        legs = {}
+        if answer is not None:
+            results, legs = answer["results"], answer["legs"]
+        else:
+            from lib.hybrid_search import rrf_search
+            results = rrf_search(
+                args.query,
+                args.k,
+                args.limit,
+                args.enhance,
+                args.rerank_method,
+                legs = legs,
+            )
 
         print(f"RRF search results for: {args.query}\n")
+        print_degraded_legs(legs)
         for i, curr_res in enumerate(results, 1):
             doc_snippet = curr_res["document"].split("\n")[0][:100]
             print(f"{i}. {curr_res['title']}")
@@ -99,6 +134,7 @@ def main():
                 )
 
             try:
+                from lib.llm_prompt import Llm
                 llm = Llm()
                 eval_response = llm.evaluate_prompt(
                     args.query, formatted_results_for_llm
@@ -3,11 +3,27 @@
 import argparse
 import json
 import math
+import os
+import time
 from nltk.stem import PorterStemmer
 
-import inverted_index
+from lib import keyword_search as inverted_index
+from lib.segmented_index import SegmentedIndex, clear_segments
+from lib.sharded_index import ShardedIndex, build_shards
+from lib.batch_search import segmented_search_batch
+from lib.search_client import remote_call
 
 
+def print_bm25_results(results, search_stats):
+
+    for i, res in enumerate(results, 1):
+        print(f"{i}. ({res["id"]}) {res["title"]} - Score: {res["score"]:.2f}")
+
+    if search_stats["phrases_ignored"]:
+        print("Phrase constraints ignored: rebuild with `build --positions` to enable them")
+    print(f"Postings scored: {search_stats["postings_scored"]}, "
+          f"skipped: {search_stats["postings_skipped"]}")
+
 def main() -> None:
 
 
@@ -18,6 +34,10 @@ def main() -> None:
     search_parser.add_argument("query", type=str, help="Search query")
 
     build_parser = subparsers.add_parser("build", help="Build inverted index and save it to disk")
+    build_parser.add_argument("--workers", type=int, default=1,
+                              help="Worker processes for tokenizing (0 = one per CPU core)")
+    build_parser.add_argument("--positions", action="store_true",
+                              help="Store word positions to enable \"phrase\" and \"proximity\"~N queries")
 
     tf_parser = subparsers.add_parser("tf", help="Get term frequencies for given term")
     tf_parser.add_argument("doc_id", type=int, help="document where term exists")
@@ -36,8 +56,23 @@ def main() -> None:
                                 help="Tunable BM25 b parameter")
 
     bm25search_parser = subparsers.add_parser("bm25search", help="Search movies using full BM25 scoring")
-    bm25search_parser.add_argument("query", type=str, help="Search query")
+    bm25search_parser.add_argument("query", type=str,
+                                   help='Search query; "quoted words" match as a phrase, "words"~N within N positions')
     bm25search_parser.add_argument("--limit", type=int, help="score count limit", default=5)
+    bm25search_parser.add_argument("--exhaustive", action="store_true",
+                                   help="Score every posting instead of WAND top-k pruning")
+    bm25search_parser.add_argument("--sharded", action="store_true",
+                                   help="Search the sharded index written by `shard`")
+
+    bm25batch_parser = subparsers.add_parser("bm25batch", help="BM25 search every query in a file as one batch")
+    bm25batch_parser.add_argument("queries", type=str, help="File with one query per line")
+    bm25batch_parser.add_argument("--limit", type=int, help="score count limit", default=5)
+
+    shard_parser = subparsers.add_parser("shard", help="Partition the catalog into index shards")
+    shard_parser.add_argument("--shards", type=int, default=0,
+                              help="Number of shards (0 = one per CPU core)")
+    shard_parser.add_argument("--positions", action="store_true",
+                              help="Store word positions in every shard")
 
     bm25_idf_parser = subparsers.add_parser(
       'bm25idf', help="Get BM25 IDF score for a given term"
@@ -47,6 +82,19 @@ def main() -> None:
     idf_parser = subparsers.add_parser("idf", help="Get inverse document frequency for term")
     idf_parser.add_argument("term", type=str, help="Token to search for")
 
+    add_parser = subparsers.add_parser("add", help="Add or update movies as a new index segment")
+    add_parser.add_argument("path", type=str, help="JSON file with a list of movies or {\"movies\": [...]}")
+
+    delete_parser = subparsers.add_parser("delete", help="Delete movies from the index by id")
+    delete_parser.add_argument("doc_ids", type=int, nargs="+", help="Ids of the movies to delete")
+
+    merge_parser = subparsers.add_parser("merge", help="Compact all index segments into one")
+
+    segments_parser = subparsers.add_parser("segments", help="List live index segments")
+
+    stats_parser = subparsers.add_parser("stats", help="Show precomputed BM25 collection statistics")
+    stats_parser.add_argument("term", type=str, nargs='?', help="Optional term to show df and IDF for")
+
     args = parser.parse_args()
     
     f_movies = open("data/movies.json", "r")
@@ -104,8 +152,15 @@ def main() -> None:
         case "build":
 
 
-            inv_idx.build(movies)
+            workers = args.workers if args.workers > 0 else os.cpu_count()
+
+            inv_idx.build(movies, workers, args.positions)
             inv_idx.save()
+            clear_segments()
+
+            if workers <= 1:
+                cache_stats = inv_idx.analyzer.cache_stats()
+                print(f"Stem cache: {cache_stats["size"]} words, hit rate {cache_stats["hit_rate"]:.1%}")
 
         case "tf":
 
@@ -173,15 +228,154 @@ def main() -> None:
 
         case "bm25search":
 
+            try:
+                answer = None if args.sharded or args.exhaustive else remote_call(
+                        "keyword", {"query": args.query, "limit": args.limit})
+
+                if answer is not None:
+                    print_bm25_results(answer["results"], answer["stats"])
+                    return
+
+                if args.sharded:
+                    seg_idx = ShardedIndex(stopwords, stemmer)
+                    seg_idx.start()
+                else:
+                    seg_idx = SegmentedIndex(stopwords, stemmer)
+                    seg_idx.load()
+
+                results = seg_idx.bm25_search(args.query, args.limit, args.exhaustive)
+
+                print_bm25_results([{"id": doc_id, "title": seg_idx.docmap[doc_id]["title"], "score": score}
+                                    for doc_id, score in results], seg_idx.last_search_stats)
+
+                cache_stats = seg_idx.analyzer.cache_stats()
+                print(f"Stem cache hit rate: {cache_stats["hit_rate"]:.1%}")
+
+                if args.sharded:
+                    seg_idx.close()
+
+            except Exception as e:
+
+                      print(e)
+                      return
+
+        case "bm25batch":
+
+            try:
+                seg_idx = SegmentedIndex(stopwords, stemmer)
+                seg_idx.load()
+
+                with open(args.queries, "r") as f_queries:
+                    queries = [line.strip() for line in f_queries if line.strip()]
+
+                start = time.perf_counter()
+                batch_results = segmented_search_batch(seg_idx, queries, args.limit)
+                elapsed = time.perf_counter() - start
+
+                for query, results in zip(queries, batch_results):
+                    print(f"{query}: " + ", ".join(f"{doc_id} ({score:.2f})" for doc_id, score in results))
+
+                print(f"{len(queries)} queries in {elapsed:.3f}s ({len(queries) / max(elapsed, 1e-9):.0f} queries/s)")
+
+            except Exception as e:
+
+                      print(e)
+                      return
+
+        case "shard":
+
+            num_shards = args.shards if args.shards > 0 else os.cpu_count()
+
+            manifest = build_shards(movies, num_shards, stopwords, stemmer, args.positions)
+            print(f"Wrote {num_shards} shards covering {manifest["N"]} documents")
+
+        case "add":
+
+            try:
+                with open(args.path, "r") as f_new:
+                    new_movies = json.load(f_new)
+                if isinstance(new_movies, dict):
+                    new_movies = new_movies["movies"]
+
+                seg_idx = SegmentedIndex(stopwords, stemmer)
+                seg_idx.load()
+                seg_idx.add_documents(new_movies)
+                seg_idx.wait_for_merge()
+
+                print(f"Added {len(new_movies)} movies, {len(seg_idx.segments)} segments live")
+
+            except Exception as e:
+
+                      print(e)
+                      return
+
+        case "delete":
+
+            try:
+                seg_idx = SegmentedIndex(stopwords, stemmer)
+                seg_idx.load()
+                deleted = seg_idx.delete_documents(args.doc_ids)
+
+                print(f"Deleted {deleted} of {len(args.doc_ids)} movies")
+
+            except Exception as e:
+
+                      print(e)
+                      return
+
+        case "merge":
+
+            try:
+                seg_idx = SegmentedIndex(stopwords, stemmer)
+                seg_idx.load()
+                seg_idx.merge()
+
+                print(f"Merged into {len(seg_idx.segments)} segment(s), {len(seg_idx.docmap)} movies live")
+
+            except Exception as e:
+
+                      print(e)
+                      return
+
+        case "segments":
+
+            try:
+                seg_idx = SegmentedIndex(stopwords, stemmer)
+                seg_idx.load()
+
+                for segment in seg_idx.segments:
+                    print(f"{segment.path}: {segment.live_doc_count()} live, {len(segment.tombstones)} deleted")
+
+            except Exception as e:
+
+                      print(e)
+                      return
+
+        case "stats":
+
             try:
                 inv_idx.load()
 
-                inv_idx.bm25_search(args.query, args.limit)
+                stats = inv_idx.stats
+                print(f"Documents: {stats.N}")
+                print(f"Vocabulary size: {len(stats.doc_freqs)}")
+                print(f"Average document length: {stats.avg_doc_length:.2f}")
+
+                if args.term:
+                    tokens = inv_idx.tokenizer(args.term)
+                    if not tokens:
+                        print(f"'{args.term}' is a stopword or has no searchable terms")
+                        return
+
+                    token = tokens[0]
+                    print(f"'{args.term}' -> '{token}': df={stats.df(token)}, "
+                          f"idf={stats.idf(token):.2f}, bm25idf={stats.bm25_idf(token):.2f}")
 
             except Exception as e:
 
                       print(e)
                       return
+
         case _:
             parser.print_help()
 
@@ -0,0 +1,68 @@
+import string
+from functools import lru_cache
+
+# Distinct words whose stems stay cached; vocabulary is Zipfian, so this
+# covers nearly every occurrence in a movie catalog.
+STEM_CACHE_SIZE = 1 << 16
+
+PUNCTUATION_TABLE = str.maketrans(dict.fromkeys(string.punctuation, None))
+
+class Analyzer:
+    """Lowercase, strip punctuation, drop stopwords and stem.
+
+    Produces exactly the tokens InvertedIndex.tokenizer always has, but the
+    translation table is built once, stopwords are a frozenset and stems
+    are memoized in a bounded LRU, so each distinct word is stemmed once.
+    """
+
+    def __init__(self, stopwords, stemmer, cache_size = STEM_CACHE_SIZE):
+
+        self.stopwords = frozenset(stopwords)
+        self.stemmer = stemmer
+        self.cache_size = cache_size
+        self.stem = lru_cache(maxsize = cache_size)(stemmer.stem)
+
+    def __getstate__(self):
+
+        # The LRU wraps a bound method and can't be pickled; worker processes
+        # start with an empty cache of their own.
+        return {"stopwords": self.stopwords, "stemmer": self.stemmer, "cache_size": self.cache_size}
+
+    def __setstate__(self, state):
+
+        self.__init__(state["stopwords"], state["stemmer"], state["cache_size"])
+
+    def analyze(self, text):
+
+        stopwords = self.stopwords
+        stem = self.stem
+
+        return [
+                stem(word)
+                for word in text.lower().translate(PUNCTUATION_TABLE).split()
+                if word not in stopwords
+                ]
+
+    def analyze_positions(self, text):
+        """Tokens with their word position; stopwords are dropped but counted."""
+
+        stopwords = self.stopwords
+        stem = self.stem
+
+        return [
+                (position, stem(word))
+                for position, word in enumerate(text.lower().translate(PUNCTUATION_TABLE).split())
+                if word not in stopwords
+                ]
+
+    def cache_stats(self):
+
+        info = self.stem.cache_info()
+        lookups = info.hits + info.misses
+
+        return {
+                "hits": info.hits,
+                "misses": info.misses,
+                "size": info.currsize,
+                "hit_rate": info.hits / lookups if lookups else 0.0,
+                }
@@ -0,0 +1,114 @@
+import os
+import numpy as np
+
+# Rows scored per block while assigning vectors to their nearest centroid.
+ASSIGN_BLOCK = 1 << 14
+
+# k-means is trained on at most this many sampled vectors per list.
+TRAIN_POINTS_PER_LIST = 64
+
+# IVF lists scanned per query when a chunk search runs approximately.
+DEFAULT_NPROBE = 8
+
+class IVFIndex:
+    """Inverted-file ANN index over L2-normalized vectors.
+
+    A spherical k-means coarse quantizer splits the vectors into `nlist`
+    lists. A query scores the centroids, then only the vectors in its
+    `nprobe` closest lists, so the work per query grows with
+    nprobe * n / nlist rather than n. With nprobe == nlist the search is
+    exact. Lists are stored CSR style: list i holds ids
+    list_ids[list_offsets[i]:list_offsets[i + 1]]. `source_stamp` is the
+    file_stamp() of the embeddings file the index was built from.
+    """
+
+    def __init__(self, centroids, list_offsets, list_ids, source_stamp = None):
+
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.source_stamp = source_stamp
+
+    @property
+    def nlist(self):
+
+        return len(self.centroids)
+
+    @property
+    def num_vectors(self):
+
+        return len(self.list_ids)
+
+    @classmethod
+    def build(cls, vectors, nlist = None, iterations = 10, seed = 0, source_stamp = None):
+
+        n = len(vectors)
+        if n == 0: raise Exception("no vectors to index")
+
+        nlist = min(n, nlist or max(1, int(4 * np.sqrt(n))))
+        rng = np.random.default_rng(seed)
+
+        sample_size = min(n, nlist * TRAIN_POINTS_PER_LIST)
+        sample = vectors[np.sort(rng.choice(n, sample_size, replace = False))]
+        centroids = sample[rng.choice(sample_size, nlist, replace = False)].copy()
+
+        for _ in range(iterations):
+
+            assignments = assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+
+            # Empty lists keep their previous centroid.
+            norms = np.linalg.norm(sums, axis = 1, keepdims = True)
+            centroids = np.where(norms > 0, sums / np.where(norms == 0, 1, norms), centroids)
+
+        assignments = assign(vectors, centroids)
+        list_ids = np.argsort(assignments, kind = "stable")
+        list_offsets = np.zeros(nlist + 1, dtype = np.int64)
+        np.cumsum(np.bincount(assignments, minlength = nlist), out = list_offsets[1:])
+
+        return cls(centroids.astype(np.float32), list_offsets, list_ids.astype(np.int64), source_stamp)
+
+    def search(self, query, vectors, nprobe):
+        """(ids, scores) of every vector in the `nprobe` lists closest to `query`."""
+
+        nprobe = max(1, min(nprobe, self.nlist))
+
+        centroid_scores = self.centroids @ query
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+
+        ids = np.concatenate([self.list_ids[self.list_offsets[i]:self.list_offsets[i + 1]] for i in probe])
+
+        return ids, vectors[ids] @ query
+
+    def save(self, path):
+
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, centroids = self.centroids, list_offsets = self.list_offsets, list_ids = self.list_ids,
+                 source_stamp = np.array(self.source_stamp or (0, 0), dtype = np.int64))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+
+        with np.load(path) as data:
+            source_stamp = tuple(int(v) for v in data["source_stamp"]) if "source_stamp" in data else None
+            return cls(data["centroids"], data["list_offsets"], data["list_ids"], source_stamp)
+
+def file_stamp(path):
+    """(size, mtime_ns) of `path`, used to notice a rebuilt source matrix."""
+
+    st = os.stat(path)
+
+    return (st.st_size, st.st_mtime_ns)
+
+def assign(vectors, centroids):
+    """Index of the most similar centroid for every vector, in blocks."""
+
+    assignments = np.empty(len(vectors), dtype = np.int64)
+
+    for start in range(0, len(vectors), ASSIGN_BLOCK):
+        block = vectors[start:start + ASSIGN_BLOCK]
+        assignments[start:start + ASSIGN_BLOCK] = np.argmax(block @ centroids.T, axis = 1)
+
+    return assignments
@@ -1,8 +1,8 @@
 from .hybrid_search import rrf_search, HybridSearch 
+from .fusion import RRF_K
 from .llm_prompt import Llm
 import json 
 
-RRF_K = 60
 DEFAULT_LIMIT = 5
 
 def format_docs_for_prompt(results):
@@ -13,13 +13,13 @@ def format_docs_for_prompt(results):
         doc_strings.append(f"{i}. {title}: {description_snippet}")
     return "\n".join(doc_strings)
 
-def perform_rag(query):
+def perform_rag(query, hy_search = None):
     search_results = []
     rag_response = ""
     error_message = None
 
     try:
-        search_results = rrf_search(query, RRF_K, DEFAULT_LIMIT, enhance="", rerank="")
+        search_results = rrf_search(query, RRF_K, DEFAULT_LIMIT, enhance="", rerank="", hy_search = hy_search)
         if not search_results:
             error_message = "No search results found."
             return search_results, rag_response, error_message
@@ -49,7 +49,7 @@ Provide a comprehensive answer that addresses the query based on the documents:"
 
     return search_results, rag_response, error_message
 
-def perform_summary(query, limit=DEFAULT_LIMIT):
+def perform_summary(query, limit=DEFAULT_LIMIT, hy_search = None):
     search_results = []
     summary_response = ""
     error_message = None
@@ -67,7 +67,7 @@ def perform_summary(query, limit=DEFAULT_LIMIT):
              error_message = "Error: Could not decode data/movies.json."
              return search_results, summary_response, error_message
 
-        search_results = rrf_search(query, RRF_K, limit, enhance="", rerank="")
+        search_results = rrf_search(query, RRF_K, limit, enhance="", rerank="", hy_search = hy_search)
 
         if not search_results:
             error_message = "No search results found."
@@ -109,7 +109,7 @@ def format_docs_for_citation_prompt(results):
         doc_strings.append(f"[{i}] {title}: {description_snippet}")
     return "\n".join(doc_strings)
 
-def perform_rag_with_citations(query, limit=DEFAULT_LIMIT):
+def perform_rag_with_citations(query, limit=DEFAULT_LIMIT, hy_search = None):
     search_results = []
     citation_response = ""
     error_message = None
@@ -127,7 +127,7 @@ def perform_rag_with_citations(query, limit=DEFAULT_LIMIT):
              error_message = "Error: Could not decode data/movies.json."
              return search_results, citation_response, error_message
 
-        search_results = rrf_search(query, RRF_K, limit, enhance="", rerank="")
+        search_results = rrf_search(query, RRF_K, limit, enhance="", rerank="", hy_search = hy_search)
 
         if not search_results:
             error_message = "No search results found."
@@ -168,7 +168,7 @@ Answer:"""
 
     return search_results, citation_response, error_message
 
-def perform_question_answering(question, limit=DEFAULT_LIMIT):
+def perform_question_answering(question, limit=DEFAULT_LIMIT, hy_search = None):
     search_results = []
     answer_response = ""
     error_message = None
@@ -186,7 +186,7 @@ def perform_question_answering(question, limit=DEFAULT_LIMIT):
              error_message = "Error: Could not decode data/movies.json."
              return search_results, answer_response, error_message
 
-        search_results = rrf_search(question, RRF_K, limit, enhance="", rerank="")
+        search_results = rrf_search(question, RRF_K, limit, enhance="", rerank="", hy_search = hy_search)
 
         if not search_results:
             error_message = "No search results found to answer the question."
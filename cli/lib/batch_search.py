@@ -0,0 +1,156 @@
+import numpy as np
+from .keyword_search import BM25_K1, parse_query
+from .ranking import top_k_indices
+
+# Cap on the dense (queries x docs) score block accumulated at once.
+BATCH_SCORE_CELLS = 1 << 22
+
+class BM25Matrix:
+    """Precomputed BM25 weights of an InvertedIndex for batch scoring.
+
+    The weights form a sparse term x doc matrix in CSR layout: `indptr`
+    delimits each term id's row, `ordinals` holds its doc ordinals and
+    `weights` the BM25 score of that posting. A batch of queries is a
+    sparse query x term matrix; multiplying it in is one gather of the
+    query terms' rows and one np.bincount into a dense score block. Each
+    query's terms are accumulated in query order, so scores are bit for
+    bit the ones bm25_search computes. Postings of the `deleted` doc
+    ordinals get weight 0, so those documents never match.
+    """
+
+    def __init__(self, index, stats = None, k1: float = BM25_K1, deleted = ()):
+
+        self.index = index
+        self.stats = stats or index.stats
+        self.N = index.N
+        self.doc_ids = np.asarray(index.doc_ids, dtype = np.int64)
+
+        norms = np.fromiter((self.stats.length_norm(ordinal) for ordinal in range(self.N)),
+                            dtype = np.float64, count = self.N)
+
+        term_ids = dict(index.term_ids.items())
+        rows = [index.postings[term_id] for term_id in range(len(term_ids))]
+
+        self.term_ids = term_ids
+        self.indptr = np.zeros(len(rows) + 1, dtype = np.int64)
+        np.cumsum([len(postings) for postings in rows], out = self.indptr[1:])
+
+        self.ordinals = np.concatenate(
+                [np.frombuffer(postings.doc_ids, dtype = np.uint32) for postings in rows]
+                or [np.zeros(0, dtype = np.uint32)]).astype(np.int64)
+        tfs = np.concatenate(
+                [np.frombuffer(postings.tfs, dtype = np.uint32) for postings in rows]
+                or [np.zeros(0, dtype = np.uint32)]).astype(np.float64)
+
+        idfs = np.zeros(len(rows), dtype = np.float64)
+        for term, term_id in term_ids.items():
+            idfs[term_id] = self.stats.bm25_idf(term)
+
+        # Same operation order as bm25_tf(tf, norm, k1) * idf.
+        self.weights = (tfs * (k1 + 1)) / (tfs + k1 * norms[self.ordinals])
+        self.weights *= np.repeat(idfs, np.diff(self.indptr))
+
+        if deleted:
+            self.weights[np.isin(self.ordinals, np.fromiter(deleted, dtype = np.int64, count = len(deleted)))] = 0.0
+
+    def score_block(self, token_lists):
+        """Dense (len(token_lists), N) BM25 scores, one row per query."""
+
+        rows = []
+        starts = []
+        ends = []
+        for row, tokens in enumerate(token_lists):
+            for token in tokens:
+                term_id = self.term_ids.get(token)
+                if term_id is None: continue
+                rows.append(row)
+                starts.append(self.indptr[term_id])
+                ends.append(self.indptr[term_id + 1])
+
+        lengths = np.asarray(ends, dtype = np.int64) - np.asarray(starts, dtype = np.int64)
+        total = int(lengths.sum())
+
+        # Indices of every gathered posting: each range start plus 0..len-1.
+        offsets = np.repeat(np.cumsum(lengths) - lengths - np.asarray(starts, dtype = np.int64), lengths)
+        gather = np.arange(total, dtype = np.int64) - offsets
+
+        cells = np.repeat(np.asarray(rows, dtype = np.int64), lengths) * self.N + self.ordinals[gather]
+        scores = np.bincount(cells, weights = self.weights[gather], minlength = len(token_lists) * self.N)
+
+        return scores.reshape(len(token_lists), self.N)
+
+    def top_k(self, scores, limit):
+        """(doc_id, score) pairs of one score row, ties broken by doc id."""
+
+        top = top_k_indices(scores, min(limit, int(np.count_nonzero(scores))))
+
+        return [(int(self.doc_ids[ordinal]), float(scores[ordinal])) for ordinal in top]
+
+    def search(self, token_lists, limit):
+
+        results = []
+        block = max(1, BATCH_SCORE_CELLS // max(1, self.N))
+
+        for start in range(0, len(token_lists), block):
+            scores = self.score_block(token_lists[start:start + block])
+            results.extend(self.top_k(row, limit) for row in scores)
+
+        return results
+
+def bm25_search_batch(index, queries, limit, matrix = None):
+    """bm25_search for every query in `queries`, scored as one batch.
+
+    Queries with phrase constraints on a positional index are answered by
+    the index one at a time; queries without any tokens get no results.
+    """
+
+    matrix = matrix or BM25Matrix(index)
+
+    parsed = [parse_query(index.analyzer, query) for query in queries]
+    batched = [i for i, (tokens, phrases) in enumerate(parsed) if not (phrases and index.positional)]
+
+    results = [[] for _ in queries]
+    for i, result in zip(batched, matrix.search([parsed[i][0] for i in batched], limit)):
+        results[i] = result
+
+    for i, (tokens, phrases) in enumerate(parsed):
+        if tokens and phrases and index.positional:
+            results[i] = index.search_tokens(tokens, limit, phrases = phrases)
+
+    return results
+
+def segmented_search_batch(seg_idx, queries, limit):
+    """SegmentedIndex.bm25_search for every query in `queries`, scored as one batch.
+
+    Each live segment is scored with its own BM25Matrix under the
+    collection statistics summed over all segments, with its deleted
+    documents left out. The per-segment top `limit` are then merged as
+    bm25_search merges them, so added and deleted movies are seen exactly
+    as a single query sees them. Phrase queries on a positional index go
+    through bm25_search one at a time; queries without any tokens get no
+    results.
+    """
+
+    segments, segment_stats = seg_idx.global_stats()
+    positional = seg_idx.positional()
+
+    parsed = [parse_query(seg_idx.analyzer, query) for query in queries]
+    batched = [i for i, (tokens, phrases) in enumerate(parsed) if not (phrases and positional)]
+    token_lists = [parsed[i][0] for i in batched]
+
+    merged = [[] for _ in batched]
+    for segment, stats in zip(segments, segment_stats):
+        matrix = BM25Matrix(segment.index, stats, deleted = segment.deleted)
+        for row, result in enumerate(matrix.search(token_lists, limit)):
+            merged[row].extend(result)
+
+    results = [[] for _ in queries]
+    for i, result in zip(batched, merged):
+        result.sort(key = lambda a: (-a[1], a[0]))
+        results[i] = result[:limit]
+
+    for i, (tokens, phrases) in enumerate(parsed):
+        if tokens and phrases and positional:
+            results[i] = seg_idx.bm25_search(queries[i], limit)
+
+    return results
@@ -0,0 +1,191 @@
+import itertools
+import queue
+import threading
+import time
+import numpy as np
+from .embedding_cache import text_keys
+from .npy_appender import NpyAppender
+
+# Chunks embedded together; the encoder length-sorts each window.
+STREAM_WINDOW = 2048
+
+# Windows buffered between two stages. With the one in each stage's hands
+# at most 2 * QUEUE_DEPTH + 3 windows are in memory at once.
+QUEUE_DEPTH = 4
+
+def iter_chunks(documents, chunk_fn):
+    """(movie_idx, chunk_idx, total_chunks, start, end, text) for every chunk, one document at a time.
+
+    chunk_fn(description) returns the (start, end, text) of each chunk,
+    start and end being offsets into the description.
+    """
+
+    for movie_idx, doc in enumerate(documents):
+
+        if not doc.get("description") or not doc["description"].strip():
+            continue
+
+        chunks = chunk_fn(doc["description"])
+
+        for chunk_idx, (start, end, text) in enumerate(chunks):
+            yield movie_idx, chunk_idx, len(chunks), start, end, text
+
+class ChunkPipeline:
+    """Streams chunks -> embeddings -> on-disk stores in bounded memory.
+
+    A chunker thread pulls windows of chunks from a generator. The calling
+    thread embeds each window: texts already in `cache` are reused and
+    only the others go to encode_fn(list). Then normalize_fn is applied.
+    A writer thread appends vectors and metadata rows to .npy files.
+    The stages are joined by bounded queues, so a stage that runs ahead
+    waits and memory stays flat whatever the catalog size. Only the
+    16-byte text keys of all chunks are kept, to rewrite `cache` at the
+    end. Throughput, queue depths and time spent in each stage are printed
+    as windows finish.
+    """
+
+    def __init__(self, encode_fn, cache, normalize_fn, window = STREAM_WINDOW, depth = QUEUE_DEPTH):
+
+        self.encode_fn = encode_fn
+        self.cache = cache
+        self.normalize_fn = normalize_fn
+        self.window = window
+        self.depth = depth
+        self.stats = {}
+
+    def run(self, rows, embeddings_path, metadata_path, metadata_dtype):
+        """Embed (*metadata, text) `rows`; returns memory maps of the embeddings and metadata."""
+
+        chunk_queue = queue.Queue(self.depth)
+        write_queue = queue.Queue(self.depth)
+        stop = threading.Event()
+        errors = []
+        written = {}
+        keys = []
+
+        self.stats = {"chunks": 0, "cached": 0, "chunk_seconds": 0.0, "encode_seconds": 0.0, "write_seconds": 0.0}
+        start = time.perf_counter()
+
+        def put(q, item):
+
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout = 0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def get(q):
+
+            while not stop.is_set():
+                try:
+                    return q.get(timeout = 0.1)
+                except queue.Empty:
+                    pass
+
+        def chunker():
+
+            try:
+                windows = itertools.batched(rows, self.window)
+                while not stop.is_set():
+
+                    t = time.perf_counter()
+                    window = next(windows, None)
+                    self.stats["chunk_seconds"] += time.perf_counter() - t
+
+                    put(chunk_queue, window)
+                    if window is None: break
+
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+
+        def writer():
+
+            vectors_out = None
+            metadata_out = NpyAppender(metadata_path, metadata_dtype)
+
+            try:
+                while (item := get(write_queue)) is not None:
+
+                    metadata, vectors = item
+
+                    t = time.perf_counter()
+                    if vectors_out is None:
+                        vectors_out = NpyAppender(embeddings_path, np.float32, vectors.shape[1:])
+                    vectors_out.append(vectors)
+                    metadata_out.append(metadata)
+                    self.stats["write_seconds"] += time.perf_counter() - t
+
+                if not stop.is_set():
+                    if vectors_out is None:
+                        vectors_out = NpyAppender(embeddings_path, np.float32, (0,))
+                    written["embeddings"] = vectors_out.close()
+                    written["metadata"] = metadata_out.close()
+
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+
+            if "metadata" not in written:
+                metadata_out.abort()
+                if vectors_out is not None: vectors_out.abort()
+
+        threads = [threading.Thread(target = chunker, daemon = True), threading.Thread(target = writer, daemon = True)]
+        for thread in threads: thread.start()
+
+        try:
+            while (window := get(chunk_queue)) is not None:
+
+                t = time.perf_counter()
+                metadata = np.array([row[:-1] for row in window], dtype = metadata_dtype)
+                texts = [row[-1] for row in window]
+
+                window_keys = text_keys(self.cache.model_name, texts)
+                hit, hit_vectors = self.cache.lookup(window_keys)
+
+                missing = np.flatnonzero(~hit)
+                new_vectors = self.encode_fn([texts[i] for i in missing]) if len(missing) else None
+
+                dim = (new_vectors if new_vectors is not None else hit_vectors).shape[1]
+                vectors = np.empty((len(texts), dim), dtype = np.float32)
+                if hit_vectors is not None:
+                    vectors[hit] = hit_vectors
+                if new_vectors is not None:
+                    vectors[missing] = new_vectors
+
+                keys.append(window_keys)
+                self.stats["chunks"] += len(texts)
+                self.stats["cached"] += int(hit.sum())
+                self.stats["encode_seconds"] += time.perf_counter() - t
+
+                put(write_queue, (metadata, self.normalize_fn(vectors)))
+                self.__report(start, chunk_queue, write_queue)
+
+            put(write_queue, None)
+
+        except BaseException:
+            stop.set()
+            raise
+
+        finally:
+            for thread in threads: thread.join()
+
+        if errors: raise errors[0]
+        print()
+
+        # The cache is rewritten to hold exactly this build's chunks.
+        if keys:
+            self.cache.replace(np.concatenate(keys), written["embeddings"])
+
+        return written["embeddings"], written["metadata"]
+
+    def __report(self, start, chunk_queue, write_queue):
+
+        stats = self.stats
+        rate = stats["chunks"] / max(time.perf_counter() - start, 1e-9)
+
+        print(f"\r{stats["chunks"]} chunks ({rate:.0f}/s, {stats["cached"]} cached), "
+              f"queued {chunk_queue.qsize()}/{self.depth} to encode, {write_queue.qsize()}/{self.depth} to write; "
+              f"chunk {stats["chunk_seconds"]:.1f}s encode {stats["encode_seconds"]:.1f}s "
+              f"write {stats["write_seconds"]:.1f}s", end = "", flush = True)
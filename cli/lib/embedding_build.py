@@ -0,0 +1,167 @@
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from .embedding_cache import texts_digest
+from .model_registry import get_model
+
+EMBEDDING_BUILD_DIR = "cache/embedding_build"
+
+# Texts per model forward pass and per checkpoint file.
+BUILD_BATCH_SIZE = 64
+
+def text_length(text):
+    """Cheap stand-in for a text's token count."""
+
+    return len(text.split())
+
+def length_batches(lengths, batch_size):
+    """Index batches cut from the texts sorted longest first.
+
+    Texts of similar length share a batch, so little of each forward pass
+    is spent on padding, and the slowest batches start first.
+    """
+
+    order = np.argsort(-lengths, kind = "stable")
+
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+def padding_ratio(batches, lengths):
+    """Fraction of positions that are padding when each batch pads to its longest text."""
+
+    padded = sum(len(batch) * lengths[batch].max() for batch in batches)
+
+    return 1 - lengths.sum() / padded if padded else 0.0
+
+def _init_worker(model_name, threads):
+
+    # Without a cap every worker's torch would use all cores.
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+    get_model(model_name)
+
+def _encode_batch(model_name, batch_no, texts):
+
+    return batch_no, get_model(model_name).encode(texts, batch_size = len(texts), show_progress_bar = False)
+
+def clear_checkpoints():
+
+    shutil.rmtree(EMBEDDING_BUILD_DIR, ignore_errors = True)
+
+def encoder_pool(model_name, workers):
+    """A process pool whose workers each hold `model_name`, or None for workers == 1."""
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1: return None
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    # Spawned, not forked: the parent usually has torch loaded already, and
+    # forking after its OpenMP thread pool started can hang the workers.
+    # Each worker loads its own model in _init_worker anyway.
+    return ProcessPoolExecutor(max_workers = workers, mp_context = multiprocessing.get_context("spawn"),
+                               initializer = _init_worker, initargs = (model_name, threads))
+
+def encode_texts(model_name, texts, workers = 1, batch_size = BUILD_BATCH_SIZE, model = None, label = "texts",
+                 executor = None, verbose = True, keep_checkpoint = False):
+    """Embeddings of `texts` in their order, built in length-bucketed batches.
+
+    With workers > 1 (0 = one per CPU core) batches are encoded by a
+    process pool, each worker loading the model once; otherwise by `model`
+    or the registry's instance in this process. A caller encoding many
+    lists can pass its own encoder_pool() as `executor`. Every finished
+    batch is checkpointed under EMBEDDING_BUILD_DIR, keyed by the model
+    and texts, so rerunning an interrupted build only encodes the missing
+    batches. The checkpoint is removed once the whole matrix is assembled,
+    unless `keep_checkpoint` leaves that to clear_checkpoints().
+    """
+
+    if not texts: return np.zeros((0, 0), dtype = np.float32)
+
+    workers = workers or os.cpu_count() or 1
+    lengths = np.array([text_length(text) for text in texts])
+    batches = length_batches(lengths, batch_size)
+
+    checkpoint_dir = os.path.join(EMBEDDING_BUILD_DIR, texts_digest(f"{model_name}:{batch_size}", texts))
+    os.makedirs(checkpoint_dir, exist_ok = True)
+
+    def batch_path(batch_no):
+
+        return os.path.join(checkpoint_dir, f"{batch_no:06d}.npy")
+
+    def save_batch(batch_no, embeddings):
+
+        tmp_path = f"{batch_path(batch_no)}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.asarray(embeddings, dtype = np.float32))
+        os.replace(tmp_path, batch_path(batch_no))
+
+    pending = [batch_no for batch_no in range(len(batches)) if not os.path.exists(batch_path(batch_no))]
+    resumed = len(texts) - sum(len(batches[batch_no]) for batch_no in pending)
+    done = resumed
+    start = time.perf_counter()
+
+    def report(batch_no):
+
+        nonlocal done
+        done += len(batches[batch_no])
+        rate = (done - resumed) / max(time.perf_counter() - start, 1e-9)
+        if verbose:
+            print(f"\r{done}/{len(texts)} {label} embedded ({rate:.0f}/s)", end = "", flush = True)
+
+    if pending and (executor is not None or workers > 1):
+
+        own_executor = executor is None
+        if own_executor:
+            executor = encoder_pool(model_name, workers)
+
+        try:
+            futures = [executor.submit(_encode_batch, model_name, batch_no, [texts[i] for i in batches[batch_no]])
+                       for batch_no in pending]
+
+            for future in as_completed(futures):
+                batch_no, embeddings = future.result()
+                save_batch(batch_no, embeddings)
+                report(batch_no)
+        finally:
+            if own_executor:
+                executor.shutdown(cancel_futures = True)
+
+    elif pending:
+
+        model = model or get_model(model_name)
+
+        for batch_no in pending:
+            batch_texts = [texts[i] for i in batches[batch_no]]
+            save_batch(batch_no, model.encode(batch_texts, batch_size = len(batch_texts), show_progress_bar = False))
+            report(batch_no)
+
+    elapsed = time.perf_counter() - start
+    if pending and verbose: print()
+
+    out = None
+    for batch_no, batch in enumerate(batches):
+
+        embeddings = np.load(batch_path(batch_no))
+        if out is None:
+            out = np.empty((len(texts), embeddings.shape[1]), dtype = np.float32)
+        out[batch] = embeddings
+
+    if not keep_checkpoint:
+        shutil.rmtree(checkpoint_dir, ignore_errors = True)
+
+    if not verbose: return out
+
+    unsorted = [np.arange(i, min(i + batch_size, len(texts))) for i in range(0, len(texts), batch_size)]
+    encoded = len(texts) - resumed
+    print(f"Embedded {encoded} {label} in {elapsed:.1f}s ({encoded / max(elapsed, 1e-9):.0f}/s) "
+          f"with {workers} worker(s), {resumed} resumed from checkpoint; padding "
+          f"{padding_ratio(batches, lengths):.0%} vs {padding_ratio(unsorted, lengths):.0%} unsorted")
+
+    return out
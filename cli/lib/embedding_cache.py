@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import re
+import numpy as np
+from .npy_appender import NpyAppender
+
+EMBEDDING_CACHE_DIR = "cache/embedding_cache"
+EMBEDDING_MANIFEST_PATH = os.path.join(EMBEDDING_CACHE_DIR, "manifest.json")
+
+# blake2b digest bytes per text key; collisions are out of reach at 128 bits.
+KEY_SIZE = 16
+
+# Rows copied at a time when the store is rewritten.
+COPY_BLOCK = 1 << 14
+
+def text_keys(model_name, texts):
+    """Content hash of each text, salted with the model that embeds it."""
+
+    prefix = hashlib.blake2b(model_name.encode() + b"\0", digest_size = KEY_SIZE)
+
+    keys = []
+    for text in texts:
+        h = prefix.copy()
+        h.update(text.encode())
+        keys.append(h.digest())
+
+    return np.array(keys, dtype = f"S{KEY_SIZE}")
+
+def texts_digest(model_name, texts):
+    """One hash over a whole ordered list of texts, for staleness checks."""
+
+    h = hashlib.blake2b(digest_size = KEY_SIZE)
+    h.update(model_name.encode())
+
+    for text in texts:
+        h.update(b"\0")
+        h.update(text.encode())
+
+    return h.hexdigest()
+
+def read_digest(name):
+
+    if not os.path.exists(EMBEDDING_MANIFEST_PATH): return None
+
+    with open(EMBEDDING_MANIFEST_PATH, "r") as f:
+        return json.load(f).get(name)
+
+def write_digest(name, digest):
+
+    os.makedirs(EMBEDDING_CACHE_DIR, exist_ok = True)
+
+    manifest = {}
+    if os.path.exists(EMBEDDING_MANIFEST_PATH):
+        with open(EMBEDDING_MANIFEST_PATH, "r") as f:
+            manifest = json.load(f)
+
+    manifest[name] = digest
+
+    tmp_path = f"{EMBEDDING_MANIFEST_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, EMBEDDING_MANIFEST_PATH)
+
+class EmbeddingCache:
+    """Persistent text -> embedding store keyed by content hash and model.
+
+    Keys are kept sorted in one .npy file with the vectors aligned in
+    another, both memory-mapped, so a lookup of a whole batch is one
+    np.searchsorted. encode() only sends texts that are not in the store
+    to the model. Afterwards the store is rewritten to hold exactly that
+    batch's texts, which drops vectors of edited or deleted documents.
+    """
+
+    def __init__(self, model_name, kind):
+
+        slug = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+
+        self.model_name = model_name
+        self.keys_path = os.path.join(EMBEDDING_CACHE_DIR, f"{slug}.{kind}.keys.npy")
+        self.vectors_path = os.path.join(EMBEDDING_CACHE_DIR, f"{slug}.{kind}.vectors.npy")
+        self.last_stats = {}
+
+    def __load(self):
+
+        if os.path.exists(self.keys_path) and os.path.exists(self.vectors_path):
+
+            keys = np.load(self.keys_path, mmap_mode = "r")
+            vectors = np.load(self.vectors_path, mmap_mode = "r")
+
+            # A crash between the two writes leaves them out of step.
+            if len(keys) == len(vectors):
+                return keys, vectors
+
+        return np.zeros(0, dtype = f"S{KEY_SIZE}"), None
+
+    def lookup(self, keys):
+        """(hit mask, stored vectors of the hits) for text `keys`."""
+
+        store_keys, store_vectors = self.__load()
+
+        pos = np.searchsorted(store_keys, keys)
+        hit = np.zeros(len(keys), dtype = bool)
+        if len(store_keys):
+            in_range = pos < len(store_keys)
+            hit[in_range] = store_keys[pos[in_range]] == keys[in_range]
+
+        return hit, store_vectors[pos[hit]] if hit.any() else None
+
+    def replace(self, keys, vectors):
+        """Make the store hold exactly `keys` -> rows of `vectors`.
+
+        Rows are copied in key order a block at a time, so `vectors` can be
+        a memory map larger than RAM.
+        """
+
+        unique_keys, unique_rows = np.unique(keys, return_index = True)
+
+        out = NpyAppender(self.vectors_path, vectors.dtype, vectors.shape[1:])
+        try:
+            for start in range(0, len(unique_rows), COPY_BLOCK):
+                out.append(vectors[unique_rows[start:start + COPY_BLOCK]])
+        except BaseException:
+            out.abort()
+            raise
+        out.close()
+
+        tmp_path = f"{self.keys_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, unique_keys)
+        os.replace(tmp_path, self.keys_path)
+
+    def encode(self, texts, encode_fn):
+        """Embeddings for `texts`, calling encode_fn(list) only for unseen ones."""
+
+        keys = text_keys(self.model_name, texts)
+        hit, hit_vectors = self.lookup(keys)
+
+        # Identical texts are encoded once.
+        missing_keys, first = np.unique(keys[~hit], return_index = True)
+        missing_rows = np.flatnonzero(~hit)[first]
+        new_vectors = encode_fn([texts[i] for i in missing_rows]) if len(missing_rows) else None
+
+        if new_vectors is not None:
+            dim = new_vectors.shape[1]
+            dtype = new_vectors.dtype
+        elif hit_vectors is not None:
+            dim = hit_vectors.shape[1]
+            dtype = hit_vectors.dtype
+        else:
+            return np.zeros((0, 0), dtype = np.float32)
+
+        out = np.empty((len(keys), dim), dtype = dtype)
+        if hit.any():
+            out[hit] = hit_vectors
+        if new_vectors is not None:
+            out[~hit] = new_vectors[np.searchsorted(missing_keys, keys[~hit])]
+
+        self.replace(keys, out)
+
+        self.last_stats = {"texts": len(texts), "cached": int(hit.sum()), "encoded": len(missing_rows)}
+
+        return out
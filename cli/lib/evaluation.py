@@ -1,4 +1,5 @@
 from lib.hybrid_search import rrf_search
+from lib.fusion import RRF_K
 import json
 
 def evaluvate_scores(limit):
@@ -10,7 +11,7 @@ def evaluvate_scores(limit):
 
     for t in test_cases:
 
-        total_retrieved = rrf_search(t["query"], 60, limit, "", "")
+        total_retrieved = rrf_search(t["query"], RRF_K, limit, "", "")
 
         c = 0
         ret_title = []
@@ -0,0 +1,149 @@
+import numpy as np
+
+FUSION_METHODS = ("weighted", "rrf", "zscore")
+
+# RRF smoothing constant: a document at rank r contributes 1 / (k + r).
+RRF_K = 60
+
+class FusionResult:
+    """Fused candidates, best first, as arrays aligned on document.
+
+    Column j of every array is document ids[j]. scores, norms and ranks
+    have one row per input list, in `names` order. A document a list did
+    not return has score 0.0 and rank 0 in that row. norms holds what the
+    method combined: min-max scores, z-scores or 1 / (k + rank).
+    """
+
+    def __init__(self, names, ids, fused, scores, norms, ranks):
+
+        self.names = names
+        self.ids = ids
+        self.fused = fused
+        self.scores = scores
+        self.norms = norms
+        self.ranks = ranks
+
+    def __len__(self):
+
+        return len(self.ids)
+
+    def top(self, limit):
+
+        return FusionResult(self.names, self.ids[:limit], self.fused[:limit],
+                            self.scores[:, :limit], self.norms[:, :limit], self.ranks[:, :limit])
+
+    def select(self, mask):
+
+        return FusionResult(self.names, self.ids[mask], self.fused[mask],
+                            self.scores[:, mask], self.norms[:, mask], self.ranks[:, mask])
+
+def align(ranked_lists):
+    """(ids, scores, ranks) for the union of (ids, scores) lists, each best first.
+
+    ids are in order of first appearance, scanning the lists in turn.
+    scores and ranks are (len(ranked_lists), len(ids)); ranks start at 1
+    and are 0 where a list did not return the document. If a list repeats
+    an id, its best rank counts.
+    """
+
+    list_ids = [np.asarray(ids, dtype = np.int64) for ids, _ in ranked_lists]
+    all_ids = np.concatenate(list_ids) if list_ids else np.empty(0, dtype = np.int64)
+
+    unique, first, inverse = np.unique(all_ids, return_index = True, return_inverse = True)
+    order = np.argsort(first)
+    column = np.empty(len(order), dtype = np.int64)
+    column[order] = np.arange(len(order))
+
+    scores = np.zeros((len(ranked_lists), len(unique)))
+    ranks = np.zeros((len(ranked_lists), len(unique)), dtype = np.int64)
+
+    offset = 0
+    for i, (_, list_scores) in enumerate(ranked_lists):
+
+        n = len(list_ids[i])
+        cols = column[inverse[offset:offset + n]]
+        offset += n
+
+        # Written worst first, so the best entry of a repeated id is kept.
+        scores[i, cols[::-1]] = np.asarray(list_scores, dtype = np.float64)[::-1]
+        ranks[i, cols[::-1]] = np.arange(n, 0, -1)
+
+    return unique[order], scores, ranks
+
+def min_max(scores):
+    """Each row scaled to [0, 1]; a row whose scores are all equal becomes 1.0."""
+
+    lo = scores.min(axis = -1, keepdims = True)
+    span = scores.max(axis = -1, keepdims = True) - lo
+
+    norms = np.ones_like(scores)
+    np.divide(scores - lo, span, out = norms, where = span > 0)
+
+    return norms
+
+def z_scores(scores, present):
+    """Each row standardized over the documents it returned.
+
+    A document missing from a list gets that list's lowest z-score, so it
+    ranks no better than the list's worst candidate.
+    """
+
+    count = np.maximum(present.sum(axis = 1, keepdims = True), 1)
+    mean = np.where(present, scores, 0.0).sum(axis = 1, keepdims = True) / count
+    std = np.sqrt((np.where(present, scores - mean, 0.0) ** 2).sum(axis = 1, keepdims = True) / count)
+
+    z = np.zeros_like(scores)
+    np.divide(scores - mean, std, out = z, where = present & (std > 0))
+
+    floor = np.where(present, z, np.inf).min(axis = 1, keepdims = True)
+    return np.where(present, z, np.where(np.isfinite(floor), floor, 0.0))
+
+def fuse(ranked_lists, method = "weighted", weights = None, k = RRF_K, names = None):
+    """One FusionResult ranking the union of `ranked_lists`, best first.
+
+    Each list is (ids, scores) from one retriever, best first; any number
+    of lists can be fused. "weighted" sums min-max normalized scores,
+    "rrf" sums 1 / (k + rank) and "zscore" sums z-scores, each times the
+    list's weight. Weights default to 1 for rrf and 1 / len(ranked_lists)
+    otherwise. An empty list, e.g. from a retriever that timed out, gives
+    every document 0 in its row. Ties keep the order in which documents
+    first appeared.
+    """
+
+    if method not in FUSION_METHODS:
+        raise ValueError(f"unknown fusion method {method}, expected one of {FUSION_METHODS}")
+
+    if names is None:
+        names = tuple(f"list{i}" for i in range(len(ranked_lists)))
+
+    if weights is None:
+        weights = [1.0 if method == "rrf" else 1.0 / max(len(ranked_lists), 1)] * len(ranked_lists)
+
+    if len(weights) != len(ranked_lists) or len(names) != len(ranked_lists):
+        raise ValueError(f"{len(ranked_lists)} ranked lists need as many weights and names, "
+                         f"got {len(weights)} and {len(names)}")
+
+    ids, scores, ranks = align(ranked_lists)
+    if len(ids) == 0:
+        return FusionResult(tuple(names), ids, np.zeros(0), scores, scores, ranks)
+
+    present = ranks > 0
+
+    if method == "rrf":
+        norms = np.zeros_like(scores)
+        np.divide(1.0, k + ranks, out = norms, where = present)
+    elif method == "zscore":
+        norms = z_scores(scores, present)
+    else:
+        # An empty row is all equal, which min_max would scale to 1.0.
+        norms = np.where(present.any(axis = 1, keepdims = True), min_max(scores), 0.0)
+
+    # Summed list by list, which keeps the two-list sums bit-identical to
+    # alpha * a + (1 - alpha) * b.
+    fused = np.zeros(len(ids))
+    for weight, row in zip(weights, norms):
+        fused = fused + weight * row
+
+    order = np.argsort(-fused, kind = "stable")
+
+    return FusionResult(tuple(names), ids[order], fused[order], scores[:, order], norms[:, order], ranks[:, order])
@@ -3,18 +3,47 @@
 import time
 import os
 import json
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from nltk.stem import PorterStemmer
-from .keyword_search import InvertedIndex
-from .semantic_search import ChunkedSemanticSearch
+from .keyword_search import InvertedIndex, INDEX_PATH
+from .segmented_index import SegmentedIndex, clear_segments, MANIFEST_PATH
+from .semantic_search import ChunkedSemanticSearch, CHUNK_EMBEDDINGS_PATH, CHUNK_METADATA_PATH, CHUNK_IVF_PATH
+from .embedding_cache import EMBEDDING_MANIFEST_PATH
+from .result_cache import HybridResultCache, RESULT_CACHE_DIR
+from .fusion import fuse, min_max
 from .llm_prompt import Llm
-from sentence_transformers import CrossEncoder
+from .model_registry import get_model, CROSS_ENCODER_MODEL
 import logging
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Threads shared by every HybridSearch for running the retrieval legs side by side.
+LEG_WORKERS = 8
+
+# Seconds a retrieval leg may run, from when it starts, before the query answers without it.
+LEG_TIMEOUT = 5.0
+
+leg_executor = ThreadPoolExecutor(max_workers = LEG_WORKERS, thread_name_prefix = "hybrid-leg")
+
+# One slot per leg_executor thread. A leg holds its slot until it really
+# finishes, so a leg never waits in the executor's queue.
+leg_slots = threading.BoundedSemaphore(LEG_WORKERS)
+
+# Names of the fused retrieval legs, in the order their lists are passed to fuse().
+HYBRID_LEGS = ("bm25", "semantic")
+
+# Files whose rebuild changes hybrid results; cached results are keyed on their stamp.
+RESULT_SOURCE_PATHS = ("data/movies.json", "data/stopwords.txt", INDEX_PATH, MANIFEST_PATH,
+                       CHUNK_EMBEDDINGS_PATH, CHUNK_METADATA_PATH, CHUNK_IVF_PATH, EMBEDDING_MANIFEST_PATH)
+
 class HybridSearch:
-    def __init__(self, documents):
+    def __init__(self, documents, leg_timeout = LEG_TIMEOUT, persist_results = False):
         self.documents = documents
+        self.leg_timeout = leg_timeout
+        self.result_cache = HybridResultCache(RESULT_SOURCE_PATHS,
+                                              persist_dir = RESULT_CACHE_DIR if persist_results else None)
         self.semantic_search = ChunkedSemanticSearch()
         self.semantic_search.load_or_create_chunk_embeddings(documents)
 
@@ -23,163 +52,231 @@ class HybridSearch:
         f_stopwords.close()
         
         stemmer = PorterStemmer()
-        self.idx = InvertedIndex(stopwords, stemmer)
-        if not os.path.exists("cache/index.pkl"):
+        if not os.path.exists(INDEX_PATH):
             moives = []
             f_movies = open("data/movies.json", "r")
             data = json.load(f_movies)
             movies = data["movies"]
             f_movies.close()
-            self.idx.build(movies)
-            self.idx.save()
+            base_idx = InvertedIndex(stopwords, stemmer)
+            base_idx.build(movies)
+            base_idx.save()
+            clear_segments()
+        self.idx = SegmentedIndex(stopwords, stemmer)
+        self.idx.load()
 
     def _bm25_search(self, query, limit):
-        self.idx.load()
+        # Segments added or deleted by another process since the last query are picked up here.
+        self.idx.refresh()
         return self.idx.bm25_search(query, int(limit))
 
-    def weighted_search(self, query, alpha, limit=5):
+    def _retrieve(self, query, bm25_limit, sem_limit):
+        """(bm25 results, semantic results, legs), with the two legs run concurrently.
+
+        Both legs spend most of their time outside the GIL, so the wait is
+        about the slower leg rather than the sum. Each leg gets leg_timeout
+        seconds from when it starts running. A leg that fails, times out or
+        finds every leg slot busy contributes no results, and the query is
+        answered from the other one (degraded). `legs` maps each leg to its
+        status and time. Only if neither leg answers is an exception raised.
+
+        A running thread cannot be stopped, so a timed-out leg keeps running
+        in the background and holds its slot until it finishes. While
+        abandoned legs hold every slot, new legs fail fast as "busy" instead
+        of queueing behind them.
+        """
+
+        running = {}
+        legs = {}
+        for name, fn, limit in (("bm25", self._bm25_search, bm25_limit),
+                                ("semantic", self.semantic_search.search_chunks, sem_limit)):
+            if leg_slots.acquire(blocking = False):
+                running[name] = RetrievalLeg(fn, query, limit)
+            else:
+                legs[name] = {"status": "busy"}
 
-        bm25_res = self._bm25_search(query, limit) 
-        sem_res = self.semantic_search.search_chunks(query, limit) 
+        results = {}
+        for name, leg in running.items():
+            try:
+                results[name], seconds = leg.result(self.leg_timeout)
+                legs[name] = {"status": "ok", "seconds": seconds}
+            except TimeoutError:
+                legs[name] = {"status": "timeout", "seconds": self.leg_timeout}
+            except Exception as e:
+                legs[name] = {"status": "error", "error": str(e)}
 
-        combined_results = {}
-        
-        for doc_id, score in bm25_res:
-            if doc_id not in self.idx.docmap: continue
-            doc = self.idx.docmap[doc_id]
-            combined_results[doc_id] = {
+        if not results:
+            raise Exception(f"hybrid search failed, no retrieval leg answered: {legs}")
+
+        for name, leg in legs.items():
+            if leg["status"] != "ok":
+                logging.warning(f"{name} leg {leg['status']}, answering from the other leg only")
+
+        return results.get("bm25", []), results.get("semantic", []), legs
+
+    def weighted_search(self, query, alpha, limit=5, keep=None, legs=None):
+        """Union of the top `limit` of each leg by alpha * BM25 + (1 - alpha) * semantic.
+
+        Both scores are min-max normalized over the union, a missing
+        score counting as 0.0. Only the best `keep` are returned, all by
+        default. A `legs` dict is filled with this query's leg statuses.
+        """
+
+        bm25_res, sem_res, leg_status = self._retrieve(query, limit, limit)
+        if legs is not None: legs.update(leg_status)
+        bm25_res = [(doc_id, score) for doc_id, score in bm25_res if doc_id in self.idx.docmap]
+
+        fused = fuse(self._ranked_lists(bm25_res, sem_res), "weighted", [alpha, 1 - alpha], names = HYBRID_LEGS)
+        fused = fused.top(keep)
+
+        sem_docs = {res["id"]: res for res in sem_res}
+        results_list = []
+        for doc_id, (bm25_score, sem_score), (bm25_norm, sem_norm), score in zip(
+                fused.ids.tolist(), fused.scores.T.tolist(), fused.norms.T.tolist(), fused.fused.tolist()):
+            doc = self.idx.docmap.get(doc_id) or sem_docs[doc_id]
+            results_list.append({
                 "id": doc_id,
                 "title": doc["title"],
-                "document": doc["description"],
-                "bm25_score": score,
-                "sem_score": 0.0,
-            }
-
-        for res in sem_res:
-            doc_id = res["id"]
-            if doc_id in combined_results:
-                combined_results[doc_id]["sem_score"] = res["score"]
-            else:
-                combined_results[doc_id] = {
-                    "id": doc_id,
-                    "title": res["title"],
-                    "document": self.idx.docmap.get(doc_id, {}).get("description", res["document"]),
-                    "bm25_score": 0.0,
-                    "sem_score": res["score"]
-                }
-
-        bm25_scores = [res["bm25_score"] for res in combined_results.values()]
-        sem_scores = [res["sem_score"] for res in combined_results.values()]
-
-        norm_bm25 = normalize(bm25_scores)
-        norm_sem = normalize(sem_scores)
-        
-        results_list = []
-        i = 0
-        for doc_id, data in combined_results.items():
-            data["bm25_norm"] = norm_bm25[i]
-            data["sem_norm"] = norm_sem[i]
-            
-            data["hybrid_score"] =  hybrid_score(data["bm25_norm"], data["sem_norm"], alpha)
-            
-            results_list.append(data)
-            i += 1
-        results_list.sort(key=lambda x: x["hybrid_score"], reverse=True)
+                "document": doc["description"] if "description" in doc else doc["document"],
+                "bm25_score": bm25_score,
+                "sem_score": sem_score,
+                "bm25_norm": bm25_norm,
+                "sem_norm": sem_norm,
+                "hybrid_score": score,
+            })
         return results_list
 
 
-    def rrf_search(self, query, k, limit=10):
+    def rrf_search(self, query, k, limit=10, keep=None, legs=None):
+        """Union of the top `limit` of each leg by reciprocal rank fusion.
+
+        A leg that did not return a document gives it rank 0 and no score.
+        Only the best `keep` are returned, all by default. A `legs` dict is
+        filled with this query's leg statuses.
+        """
 
         fetch_limit = limit 
-        bm25_res = self._bm25_search(query, fetch_limit) 
-        sem_res = self.semantic_search.search_chunks(query, fetch_limit)
+        bm25_res, sem_res, leg_status = self._retrieve(query, fetch_limit, fetch_limit)
+        if legs is not None: legs.update(leg_status)
 
-        combined_results = {}
+        fused = fuse(self._ranked_lists(bm25_res, sem_res), "rrf", k = k, names = HYBRID_LEGS)
+        fused = fused.select(np.fromiter((doc_id in self.idx.docmap for doc_id in fused.ids.tolist()),
+                                         dtype = bool, count = len(fused)))
+        fused = fused.top(keep)
 
-        for rank, (doc_id, _) in enumerate(bm25_res, 1): # Rank starts at 1
-            if doc_id not in self.idx.docmap: continue
+        results_list = []
+        for doc_id, (bm25_rank, sem_rank), score in zip(fused.ids.tolist(), fused.ranks.T.tolist(), fused.fused.tolist()):
             doc = self.idx.docmap[doc_id]
-            score = rrf_score(rank, k)
-            
-            combined_results[doc_id] = {
+            results_list.append({
                 "id": doc_id,
                 "title": doc["title"],
                 "document": doc["description"],
-                "bm25_rank": rank,
-                "sem_rank": 0, 
+                "bm25_rank": bm25_rank,
+                "sem_rank": sem_rank,
                 "rrf_score": score
-            }
+            })
+        return results_list
 
-        for rank, res in enumerate(sem_res, 1): 
-            doc_id = res["id"]
-            score = rrf_score(rank, k)
+    def _ranked_lists(self, bm25_res, sem_res):
+        """(ids, scores) arrays of each leg, best first, in HYBRID_LEGS order."""
 
-            if doc_id in combined_results:
-                combined_results[doc_id]["rrf_score"] += score
-                combined_results[doc_id]["sem_rank"] = rank
-            else:
-                if doc_id not in self.idx.docmap: continue
-                doc = self.idx.docmap[doc_id]
-                combined_results[doc_id] = {
-                    "id": doc_id,
-                    "title": doc["title"],
-                    "document": doc["description"],
-                    "bm25_rank": 0,
-                    "sem_rank": rank,
-                    "rrf_score": score
-                }
-
-        results_list = sorted(combined_results.values(), key=lambda x: x["rrf_score"], reverse=True)
-        
-        return results_list
+        return [
+            (np.fromiter((doc_id for doc_id, _ in bm25_res), dtype = np.int64, count = len(bm25_res)),
+             np.fromiter((score for _, score in bm25_res), dtype = np.float64, count = len(bm25_res))),
+            (np.fromiter((res["id"] for res in sem_res), dtype = np.int64, count = len(sem_res)),
+             np.fromiter((res["score"] for res in sem_res), dtype = np.float64, count = len(sem_res))),
+        ]
+
+class RetrievalLeg:
+    """fn(*args) on leg_executor, holding a leg_slots slot the caller acquired until it returns."""
+
+    def __init__(self, fn, *args):
+
+        self.fn = fn
+        self.args = args
+        self.started = threading.Event()
+        self.start_time = None
+
+        try:
+            self.future = leg_executor.submit(self.__run)
+        except BaseException:
+            leg_slots.release()
+            raise
+
+    def __run(self):
+
+        self.start_time = time.perf_counter()
+        self.started.set()
+
+        try:
+            return timed(self.fn, *self.args)
+        finally:
+            leg_slots.release()
+
+    def result(self, timeout):
+        """(fn's result, seconds); TimeoutError if not done `timeout` seconds after it started."""
+
+        if not self.started.wait(timeout):
+            raise TimeoutError()
+
+        return self.future.result(timeout = max(0.0, self.start_time + timeout - time.perf_counter()))
+
+def legs_complete(legs):
+    """Whether every leg of a query answered in time."""
+
+    return all(leg["status"] == "ok" for leg in legs.values())
 
-def hybrid_score(bm25_score, semantic_score, alpha=0.5):
-    return alpha * bm25_score + (1 - alpha) * semantic_score
+def timed(fn, *args):
+
+    start = time.perf_counter()
+    result = fn(*args)
+
+    return result, time.perf_counter() - start
 
 def normalize(scores):
     if not scores:
         return []
-        
-    min_score = min(scores)
-    max_score = max(scores)
 
-    if min_score == max_score:
-        return [1.0] * len(scores)
+    return min_max(np.asarray(scores, dtype = np.float64)).tolist()
 
-    normalized_scores = []
-    for score in scores:
-        normalized_scores.append((score - min_score) / (max_score - min_score))
-    
-    return normalized_scores
-
-def weighted_search(query, alpha, limit):
+def load_hybrid_search():
     movies = []
     with open("data/movies.json", "r") as f:
         data = json.load(f)
         movies = data["movies"]
-    hy_search = HybridSearch(movies)
+    return HybridSearch(movies, persist_results = True)
+
+def weighted_search(query, alpha, limit, hy_search = None, legs = None):
+    if hy_search is None:
+        hy_search = load_hybrid_search()
+
+    # `legs` is left empty when the answer comes from the result cache.
+    legs = {} if legs is None else legs
+    params = {"alpha": alpha, "limit": limit}
+    return hy_search.result_cache.get("weighted", query, params,
+                                      lambda: _weighted_search(query, alpha, limit, hy_search, legs))
+
+def _weighted_search(query, alpha, limit, hy_search, legs):
+    """(results, whether both legs answered); a degraded answer is not cached."""
 
     large_limit = limit * 500 
-    res = hy_search.weighted_search(query, alpha, large_limit)
+    res = hy_search.weighted_search(query, alpha, large_limit, keep = limit, legs = legs)
 
-    for i, curr_res in enumerate(res[:limit], 1):
-        doc_snippet = curr_res["document"].split("\n")[0][:100]
-        
-        print(f"{i}. {curr_res['title']}")
-        print(f"   Hybrid Score: {curr_res['hybrid_score']:.3f}")
-        print(f"   BM25: {curr_res['bm25_norm']:.3f}, Semantic: {curr_res['sem_norm']:.3f}")
-        print(f"   {doc_snippet}...")
+    return res, legs_complete(legs)
 
-def rrf_score(rank, k=60):
-    return 1.0 / (k + rank)
 
+def rrf_search(query, k, limit, enhance, rerank, hy_search = None, legs = None):
+    if hy_search is None:
+        hy_search = load_hybrid_search()
 
-def rrf_search(query, k, limit, enhance, rerank):
-    movies = []
-    with open("data/movies.json", "r") as f:
-        data = json.load(f)
-        movies = data["movies"]
-    hy_search = HybridSearch(movies)
+    # Enhancing and reranking call the LLM, so repeated queries are the costliest to recompute.
+    legs = {} if legs is None else legs
+    params = {"k": k, "limit": limit, "enhance": enhance or "", "rerank": rerank or ""}
+    return hy_search.result_cache.get("rrf", query, params,
+                                      lambda: _rrf_search(query, k, limit, enhance, rerank, hy_search, legs))
+
+def _rrf_search(query, k, limit, enhance, rerank, hy_search, legs):
+    """(results, whether both legs answered); a degraded answer is not cached."""
 
     llm = Llm()
     if enhance:
@@ -189,7 +286,7 @@ def rrf_search(query, k, limit, enhance, rerank):
     
     fetch_limit = limit * 5 
 
-    res = hy_search.rrf_search(query, k, fetch_limit)
+    res = hy_search.rrf_search(query, k, fetch_limit, legs = legs)
     logging.debug(f"RRF results (pre-rerank): {[doc['title'] for doc in res]}")
 
     if rerank:
@@ -234,7 +331,7 @@ def rrf_search(query, k, limit, enhance, rerank):
 
     if rerank == "cross_encoder":
             
-            cross_encoder = CrossEncoder("cross-encoder/ms-marco-TinyBERT-L2-v2")
+            cross_encoder = get_model(CROSS_ENCODER_MODEL, "cross_encoder")
 
             pairs = []
             for doc in res:
@@ -249,4 +346,4 @@ def rrf_search(query, k, limit, enhance, rerank):
             res.sort(key=lambda x: x.get('cross_encoder_score', -float('inf')), reverse=True)
     final_results = res[:limit]
     logging.debug(f"Final results (post-rerank): {[doc['title'] for doc in final_results]}")
-    return final_results 
+    return final_results, legs_complete(legs)
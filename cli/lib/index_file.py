@@ -0,0 +1,305 @@
+import json
+import mmap
+import os
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from collections.abc import Mapping
+from functools import lru_cache
+from .postings import PostingList
+
+INDEX_MAGIC = b"HOOPLAIX"
+INDEX_VERSION = 2
+FLAG_POSITIONS = 1
+POSTINGS_CACHE_SIZE = 4096
+
+# Query terms whose term id, or absence, stays cached per mapped index.
+TERM_ID_CACHE_SIZE = 1 << 16
+
+# magic, version, flags, doc count, term count, average doc length, then the
+# byte offset of every section in SECTIONS order.
+SECTIONS = (
+        "term_offsets",     # u64[terms + 1] into term_blob
+        "term_blob",        # utf-8 terms, sorted by their encoded bytes
+        "postings_offsets", # u64[terms + 1] into postings_blob
+        "postings_blob",    # PostingList.encode() per term, doc ordinals (+ positions)
+        "doc_freqs",        # u32[terms]
+        "max_scores",       # f64[terms], per-term BM25 upper bound
+        "doc_ids",          # u32[docs], sorted; position is the doc ordinal
+        "doc_lengths",      # f64[docs]
+        "length_norms",     # f64[docs], BM25 length norm for the default b
+        "doc_offsets",      # u64[docs + 1] into doc_blob
+        "doc_blob",         # one JSON document per ordinal
+        )
+HEADER = struct.Struct(f"<8sIIQQd{len(SECTIONS)}Q")
+
+def _pad(f):
+
+    f.write(b"\0" * (-f.tell() % 8))
+
+    return f.tell()
+
+def _write_offsets_and_blob(f, chunks):
+
+    offsets = array("Q", [0])
+    for chunk in chunks:
+        offsets.append(offsets[-1] + len(chunk))
+
+    offsets_at = _pad(f)
+    f.write(offsets.tobytes())
+    blob_at = _pad(f)
+    for chunk in chunks:
+        f.write(chunk)
+
+    return offsets_at, blob_at
+
+def write_index(path, terms, postings, doc_freqs, max_scores, doc_ids, doc_lengths,
+                length_norms, avg_doc_length, docs, positional = False):
+    """Write an index to `path` in the single-file mmap format.
+
+    `terms` must be sorted by their utf-8 bytes and `postings`, `doc_freqs`
+    and `max_scores` aligned with it. Doc-level arrays and `docs` are indexed
+    by doc ordinal. With `positional` the postings carry word positions. The
+    file is written next to `path` and renamed over it, so processes that
+    still have the old index mapped keep a valid view.
+    """
+
+    offsets = {}
+    tmp_path = f"{path}.tmp"
+
+    with open(tmp_path, "wb") as f:
+
+        f.write(b"\0" * HEADER.size)
+
+        offsets["term_offsets"], offsets["term_blob"] = _write_offsets_and_blob(
+                f, [term.encode() for term in terms])
+        offsets["postings_offsets"], offsets["postings_blob"] = _write_offsets_and_blob(
+                f, [bytes(p.encode()) for p in postings])
+
+        offsets["doc_freqs"] = _pad(f)
+        f.write(array("I", doc_freqs).tobytes())
+        offsets["max_scores"] = _pad(f)
+        f.write(array("d", max_scores).tobytes())
+
+        offsets["doc_ids"] = _pad(f)
+        f.write(array("I", doc_ids).tobytes())
+        offsets["doc_lengths"] = _pad(f)
+        f.write(array("d", doc_lengths).tobytes())
+        offsets["length_norms"] = _pad(f)
+        f.write(array("d", length_norms).tobytes())
+
+        offsets["doc_offsets"], offsets["doc_blob"] = _write_offsets_and_blob(
+                f, [json.dumps(doc).encode() for doc in docs])
+
+        f.seek(0)
+        flags = FLAG_POSITIONS if positional else 0
+        f.write(HEADER.pack(INDEX_MAGIC, INDEX_VERSION, flags, len(doc_ids), len(terms),
+                            avg_doc_length, *(offsets[name] for name in SECTIONS)))
+
+    os.replace(tmp_path, path)
+
+class IndexFile:
+    """Read-only, memory-mapped view of an index written by write_index.
+
+    Opening only parses the header; term lookups binary search the mapped
+    term table, and postings and documents are decoded on first access.
+    Pages are shared through the OS page cache by every process that maps
+    the same file.
+    """
+
+    def __init__(self, path):
+
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+        if len(self.mmap) < HEADER.size:
+            raise Exception(f"{path} is not a hoopla index")
+
+        (magic, version, flags, num_docs, num_terms, avg_doc_length,
+         *section_offsets) = HEADER.unpack_from(self.mmap, 0)
+
+        if magic != INDEX_MAGIC:
+            raise Exception(f"{path} is not a hoopla index")
+        if version != INDEX_VERSION:
+            raise Exception(f"{path} has index version {version}, expected {INDEX_VERSION}; rebuild it")
+
+        self.positional = bool(flags & FLAG_POSITIONS)
+        self.num_docs = num_docs
+        self.num_terms = num_terms
+        self.avg_doc_length = avg_doc_length
+
+        view = memoryview(self.mmap)
+        sections = dict(zip(SECTIONS, section_offsets))
+
+        def column(name, typecode, count):
+            start = sections[name]
+            return view[start:start + count * struct.calcsize(typecode)].cast(typecode)
+
+        self.term_offsets = column("term_offsets", "Q", num_terms + 1)
+        self.term_blob = sections["term_blob"]
+        self.postings_offsets = column("postings_offsets", "Q", num_terms + 1)
+        self.postings_blob = sections["postings_blob"]
+        self.max_scores = column("max_scores", "d", num_terms)
+        self.doc_ids = column("doc_ids", "I", num_docs)
+        self.doc_lengths = column("doc_lengths", "d", num_docs)
+        self.length_norms = column("length_norms", "d", num_docs)
+        self.doc_offsets = column("doc_offsets", "Q", num_docs + 1)
+        self.doc_blob = sections["doc_blob"]
+
+        self.term_ids = TermIds(self)
+        self.doc_freqs = TermColumn(self.term_ids, column("doc_freqs", "I", num_terms))
+        self.postings = PostingsView(self)
+        self.docmap = DocMap(self)
+
+    def term(self, term_id: int) -> str:
+
+        start = self.term_blob + self.term_offsets[term_id]
+        end = self.term_blob + self.term_offsets[term_id + 1]
+
+        return self.mmap[start:end].decode()
+
+    def find_term(self, term: str) -> int:
+
+        key = term.encode()
+        lo, hi = 0, self.num_terms
+
+        while lo < hi:
+
+            mid = (lo + hi) // 2
+            start = self.term_blob + self.term_offsets[mid]
+            end = self.term_blob + self.term_offsets[mid + 1]
+            curr = self.mmap[start:end]
+
+            if curr == key: return mid
+            if curr < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return -1
+
+    def decode_postings(self, term_id: int) -> PostingList:
+
+        postings, _ = PostingList.decode(self.mmap, self.postings_blob + self.postings_offsets[term_id],
+                                         self.positional)
+
+        return postings
+
+    def doc(self, ordinal: int) -> dict:
+
+        start = self.doc_blob + self.doc_offsets[ordinal]
+        end = self.doc_blob + self.doc_offsets[ordinal + 1]
+
+        return json.loads(self.mmap[start:end])
+
+class TermIds(Mapping):
+    """Term -> term id, by binary search of the mapped term table behind an LRU."""
+
+    def __init__(self, index_file, cache_size = TERM_ID_CACHE_SIZE):
+
+        self.index_file = index_file
+        self.find_term = lru_cache(maxsize = cache_size)(index_file.find_term)
+
+    def __getitem__(self, term):
+
+        term_id = self.find_term(term)
+        if term_id < 0: raise KeyError(term)
+
+        return term_id
+
+    def __iter__(self):
+
+        for term_id in range(self.index_file.num_terms):
+            yield self.index_file.term(term_id)
+
+    def __len__(self):
+
+        return self.index_file.num_terms
+
+class TermColumn(Mapping):
+
+    def __init__(self, term_ids, values):
+
+        self.term_ids = term_ids
+        self.values = values
+
+    def __getitem__(self, term):
+
+        return self.values[self.term_ids[term]]
+
+    def __iter__(self):
+
+        return iter(self.term_ids)
+
+    def __len__(self):
+
+        return len(self.values)
+
+class PostingsView:
+    """Term id -> PostingList, decoded from the mapped file behind an LRU."""
+
+    def __init__(self, index_file, cache_size = POSTINGS_CACHE_SIZE):
+
+        self.index_file = index_file
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __getitem__(self, term_id):
+
+        with self.lock:
+            postings = self.cache.get(term_id)
+            if postings is not None:
+                self.cache.move_to_end(term_id)
+                return postings
+
+        # Decoded outside the lock; two threads may decode the same term once.
+        postings = self.index_file.decode_postings(term_id)
+
+        with self.lock:
+            self.cache[term_id] = postings
+            self.cache.move_to_end(term_id)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last = False)
+
+        return postings
+
+    def __len__(self):
+
+        return self.index_file.num_terms
+
+class DocMap(Mapping):
+    """Doc id -> movie dict, parsed from the mapped file on access."""
+
+    def __init__(self, index_file):
+
+        self.index_file = index_file
+
+    def ordinal(self, doc_id) -> int:
+
+        doc_ids = self.index_file.doc_ids
+        pos = bisect_left(doc_ids, doc_id)
+
+        if pos < len(doc_ids) and doc_ids[pos] == doc_id:
+            return pos
+
+        return -1
+
+    def __getitem__(self, doc_id):
+
+        if not isinstance(doc_id, int): raise KeyError(doc_id)
+
+        ordinal = self.ordinal(doc_id)
+        if ordinal < 0: raise KeyError(doc_id)
+
+        return self.index_file.doc(ordinal)
+
+    def __iter__(self):
+
+        return iter(self.index_file.doc_ids)
+
+    def __len__(self):
+
+        return self.index_file.num_docs
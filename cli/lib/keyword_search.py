@@ -1,185 +1,682 @@
-import pickle
 import math
 import os
-import string
+import re
+import heapq
+from bisect import bisect_left
+from array import array
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from .postings import PostingList, intersect, phrase_match, within_window
+from .analyzer import Analyzer
+from .index_file import IndexFile, write_index
 
 BM25_K1 = 1.5
 BM25_B = 0.75
 
+# Shards handed to each worker process by a parallel build.
+SHARDS_PER_WORKER = 4
+
+CACHE_DIR = "cache"
+INDEX_PATH = os.path.join(CACHE_DIR, "index.bin")
+
+# "exact phrase" or "proximity window"~N inside a query.
+PHRASE_PATTERN = re.compile(r'"([^"]*)"(?:~(\d+))?')
+
+# Relative slack added to per-term score upper bounds so float rounding in
+# the bound sums can never prune a document that belongs in the top k.
+MAX_SCORE_SLACK = 1e-9
+
+def bm25_idf(df: int, N: int) -> float:
+
+    return math.log(1 + ((N - df + 0.5) / (df + 0.5)))
+
+def bm25_tf(tf: int, length_norm: float, k1: float = BM25_K1) -> float:
+
+    return (tf * (k1 + 1)) / (tf + k1 * length_norm)
+
+def parse_query(analyzer, query):
+    """Split a query into scoring tokens and phrase constraints.
+
+    `"dark knight"` only matches the words as an exact phrase and
+    `"dark knight"~5` only needs every word within 5 positions of the
+    others. Phrase words are scored like any other query token. Returns
+    (tokens, phrases), each phrase being ([(offset, token), ...], window)
+    with window None for an exact phrase.
+    """
+
+    tokens = []
+    phrases = []
+    pos = 0
+
+    for match in PHRASE_PATTERN.finditer(query):
+
+        tokens.extend(analyzer.analyze(query[pos:match.start()]))
+
+        terms = analyzer.analyze_positions(match.group(1))
+        tokens.extend(token for _, token in terms)
+
+        if len(terms) > 1:
+            window = int(match.group(2)) if match.group(2) is not None else None
+            phrases.append((terms, window))
+
+        pos = match.end()
+
+    tokens.extend(analyzer.analyze(query[pos:]))
+
+    return tokens, phrases
+
+def document_terms(analyzer, text, positional = False):
+    """(doc length, [(token, tf, positions or None), ...]) for one document."""
+
+    if not positional:
+
+        token_list = analyzer.analyze(text)
+
+        return len(token_list), [(token, tf, None) for token, tf in Counter(token_list).items()]
+
+    occurrences = {}
+    token_positions = analyzer.analyze_positions(text)
+    for position, token in token_positions:
+        occurrences.setdefault(token, []).append(position)
+
+    return len(token_positions), [
+            (token, len(positions), positions) for token, positions in occurrences.items()
+            ]
+
+class CollectionStats:
+    """Corpus statistics BM25 needs, computed once per build/load.
+
+    Holds per-term document frequency and BM25 IDF, the average document
+    length and each document's length norm so scoring a posting is O(1).
+    Document-level values are indexed by doc ordinal.
+    """
+
+    def __init__(self, doc_freqs, doc_lengths, N, b: float = BM25_B,
+                 avg_doc_length = None, length_norms = None, precompute_norms = True):
+
+        self.N = N
+        self.b = b
+        self.doc_lengths = doc_lengths
+
+        if avg_doc_length is None:
+            non_empty = [doc_len for doc_len in doc_lengths if doc_len]
+            avg_doc_length = sum(non_empty) / float(len(non_empty)) if non_empty else 0.0
+        self.avg_doc_length = avg_doc_length
+
+        self.doc_freqs = doc_freqs
+        self.bm25_idfs = {}
+
+        if length_norms is None and precompute_norms:
+            length_norms = array("d", (self.__length_norm(doc_len, b) for doc_len in doc_lengths))
+        self.length_norms = length_norms
+
+    def __length_norm(self, doc_len, b):
+
+        if not self.avg_doc_length:
+            return 1 - b
+
+        return 1 - b + b * (doc_len / self.avg_doc_length)
+
+    def df(self, term: str) -> int:
+
+        return self.doc_freqs.get(term, 0)
+
+    def idf(self, term: str) -> float:
+
+        return math.log((self.N + 1) / (self.df(term) + 1))
+
+    def bm25_idf(self, term: str) -> float:
+
+        idf = self.bm25_idfs.get(term)
+
+        if idf is None:
+            idf = bm25_idf(self.df(term), self.N)
+            self.bm25_idfs[term] = idf
+
+        return idf
+
+    def length_norm(self, ordinal: int, b: float = BM25_B) -> float:
+
+        if ordinal < 0:
+            return self.__length_norm(0.0, b)
+
+        if b == self.b and self.length_norms is not None:
+            return self.length_norms[ordinal]
+
+        return self.__length_norm(self.doc_lengths[ordinal], b)
+
 class InvertedIndex:
 
-    def __init__(self, stopwords, stemmer):
+    def __init__(self, stopwords, stemmer, analyzer = None):
 
-        self.index = {}
+        self.term_ids = {}
+        self.postings = []
         self.docmap = {}
+        self.doc_ids = array("I")
         self.stopwords = stopwords
         self.stemmer = stemmer
-        self.term_frequencies = {}
-        self.doc_lengths = {}
+        self.analyzer = analyzer or Analyzer(stopwords, stemmer)
+        self.doc_lengths = array("d")
         self.N = 0
+        self.max_scores = array("d")
+        self.positional = False
+        self.index_file = None
+        self.last_search_stats = {}
+        self.stats = CollectionStats({}, self.doc_lengths, self.N)
 
-    def __add_document(self, doc_id, text):
+    def __add_document(self, ordinal, text):
 
-        token_list = self.tokenizer(text)
+        doc_len, terms = document_terms(self.analyzer, text, self.positional)
 
-        for token in token_list:
+        for token, tf, positions in terms:
 
-            self.index.setdefault(token, set()).add(doc_id) # add doc to doc_id set
-            self.term_frequencies.setdefault(doc_id, Counter())[token] += 1
-            val = self.doc_lengths.get(doc_id, 0.0) 
-            self.doc_lengths[doc_id] = val + 1.0
+            self.__term_postings(token).append(ordinal, tf, positions)
 
-    def tokenizer(self, my_str):
+        self.doc_lengths[ordinal] = float(doc_len)
 
-        t_table = str.maketrans(dict.fromkeys(string.punctuation, None))
+    def __term_postings(self, token):
 
-        return [
-                self.stemmer.stem(word) 
-                for word in my_str.lower().translate(t_table).split()
-                if word and word not in self.stopwords
-                ]
+        term_id = self.term_ids.get(token)
 
-    def get_tf(self, doc_id: int, term: str) -> int:
+        if term_id is None:
+            term_id = len(self.postings)
+            self.term_ids[token] = term_id
+            self.postings.append(PostingList.positional() if self.positional else PostingList())
+
+        return self.postings[term_id]
+
+    def tokenizer(self, my_str):
+
+        return self.analyzer.analyze(my_str)
+
+    def __single_token(self, term):
 
         token = self.tokenizer(term)
         if len(token) > 1: raise Exception("too many tokens in term")
+        if len(token) == 0: raise Exception("too few tokens in term")
 
-        token = token[0]
+        return token[0]
 
-        return self.term_frequencies.get(doc_id, Counter()).get(token, 0)
+    def ordinal(self, doc_id):
 
-    def get_idf(self, term: str):
+        pos = bisect_left(self.doc_ids, doc_id)
+        if pos < len(self.doc_ids) and self.doc_ids[pos] == doc_id:
+            return pos
 
-        doc_count = self.N
-        term_doc_count = len(self.get_documents(term))
-        return math.log((doc_count + 1) / (term_doc_count + 1))
+        return -1
 
-    def get_bm25_idf(self, term: str) -> float:
+    def get_postings(self, token):
 
-        df = len(self.get_documents(term))
+        term_id = self.term_ids.get(token)
 
-        bm25idf = math.log(1 + ((self.N - df + 0.5) / (df + 0.5)))
+        return self.postings[term_id] if term_id is not None else None
 
-        return bm25idf
-    
-    def __get_avg_doc_length(self) -> float:
+    def __tf(self, ordinal, token):
 
-        sum = 0.0
+        postings = self.get_postings(token)
+        if postings is None or ordinal < 0: return 0
 
-        for doc_len in self.doc_lengths.values():
+        return postings.tf(ordinal)
 
-            sum += doc_len
+    def get_tf(self, doc_id: int, term: str) -> int:
 
-        return sum/float(len(self.doc_lengths.values()))
+        token = self.__single_token(term)
 
+        return self.__tf(self.ordinal(doc_id), token)
 
-    def get_bm25_tf(self, doc_id: int, term: str, k1: float = BM25_K1, b: float = BM25_B) -> float:
+    def get_idf(self, term: str):
 
-        tf = self.get_tf(doc_id, term)
+        token = self.__single_token(term)
 
-        length_norm = 1 - b + b * (self.doc_lengths.get(doc_id, 0.0) / self.__get_avg_doc_length())
+        return self.stats.idf(token)
 
-        bm25tf = (tf * (k1 + 1)) / (tf + k1 * length_norm)
+    def get_bm25_idf(self, term: str) -> float:
 
-        return bm25tf
+        token = self.__single_token(term)
 
-    def get_documents(self, term):
+        return self.stats.bm25_idf(token)
 
-        token = self.tokenizer(term)
+    def get_bm25_tf(self, doc_id: int, term: str, k1: float = BM25_K1, b: float = BM25_B) -> float:
+
+        tf = self.get_tf(doc_id, term)
 
-        if len(token) > 1: raise exception("too many tokens in terms")
+        return bm25_tf(tf, self.stats.length_norm(self.ordinal(doc_id), b), k1)
+
+    def get_documents(self, term):
 
-        term = token[0]
+        term = self.__single_token(term)
 
-        doc_ids = sorted(list(self.index.get(term, [])))
+        postings = self.get_postings(term)
+        ordinals = postings.doc_ids if postings is not None else []
 
         ret_list = []
-        for doc_id in doc_ids:
+        for ordinal in ordinals:
 
-            ret_list.append(self.docmap.get(doc_id, {}))
+            ret_list.append(self.docmap.get(self.doc_ids[ordinal], {}))
         return ret_list
 
     def bm25(self, doc_id, term):
 
-        bm25_idf = self.get_bm25_idf(term)
-        bm25_tf = self.get_bm25_tf(doc_id, term, BM25_K1, BM25_B)
+        token = self.__single_token(term)
+        ordinal = self.ordinal(doc_id)
 
-        return bm25_tf * bm25_idf
+        return self.__bm25(ordinal, token, self.__tf(ordinal, token))
+
+    def __bm25(self, ordinal, token, tf, stats = None):
+
+        stats = stats or self.stats
+
+        return bm25_tf(tf, stats.length_norm(ordinal), BM25_K1) * stats.bm25_idf(token)
+
+    def __upper_bound(self, term_id, token, stats):
+
+        max_score = self.max_scores[term_id]
+        if stats is self.stats: return max_score
+
+        # The stored bound used this index's own IDF and average length.
+        # Swap in the other IDF, and widen by the ratio of average lengths:
+        # a longer global average can only shrink length norms, by at most
+        # that factor, which raises the tf part by at most its inverse.
+        ratio = 1.0
+        if stats.avg_doc_length > self.stats.avg_doc_length > 0:
+            ratio = self.stats.avg_doc_length / stats.avg_doc_length
+
+        return stats.bm25_idf(token) * (max_score / self.stats.bm25_idf(token)) / ratio
     
-    def bm25_search(self, query, limit):
+    def bm25_search(self, query, limit, exhaustive = False):
 
-        query_tokens = self.tokenizer(query)
+        query_tokens, phrases = parse_query(self.analyzer, query)
         if len(query_tokens) == 0: raise Exception("too few tokens")
 
+        return self.search_tokens(query_tokens, limit, exhaustive = exhaustive, phrases = phrases)
+
+    def search_tokens(self, query_tokens, limit, stats = None, deleted = None, exhaustive = False,
+                      phrases = ()):
+        """Top-`limit` (doc_id, score) pairs for already tokenized terms.
+
+        `stats` overrides the collection statistics used for scoring (e.g.
+        global stats across segments or shards), `deleted` is a set of doc
+        ordinals to leave out and `phrases` are parse_query constraints a
+        document must satisfy. Phrases need a positional index and are
+        ignored (reported in last_search_stats) without one.
+        """
+
+        results, self.last_search_stats = self.search_tokens_with_stats(
+                query_tokens, limit, stats, deleted, exhaustive, phrases)
+
+        return results
+
+    def search_tokens_with_stats(self, query_tokens, limit, stats = None, deleted = None, exhaustive = False,
+                                 phrases = ()):
+        """(search_tokens results, their search stats), without touching last_search_stats.
+
+        Safe to call from several threads at once.
+        """
+
+        stats = stats or self.stats
+        deleted = deleted or ()
+
+        if phrases and self.positional:
+            candidates = self.phrase_candidates(phrases)
+            results, search_stats = self.__candidate_search(query_tokens, limit, stats, deleted, candidates)
+        elif exhaustive:
+            results, search_stats = self.__exhaustive_search(query_tokens, limit, stats, deleted)
+        else:
+            results, search_stats = self.__wand_search(query_tokens, limit, stats, deleted)
+
+        search_stats["phrases_ignored"] = bool(phrases) and not self.positional
+
+        return [(self.doc_ids[ordinal], score) for ordinal, score in results], search_stats
+
+    def phrase_candidates(self, phrases):
+        """Doc ordinals satisfying every phrase and proximity constraint.
+
+        Documents containing all the words are found by galloping
+        intersection of their postings, then each one's position lists are
+        galloped for an exact phrase or scanned for a short enough window.
+        """
+
+        candidates = None
+
+        for terms, window in phrases:
+
+            postings = [self.get_postings(token) for _, token in terms]
+            if any(p is None for p in postings): return set()
+
+            offsets = [offset for offset, _ in terms]
+            matches = set()
+
+            for ordinal in intersect([p.doc_ids for p in postings]):
+
+                position_lists = [p.positions_at(p.find(ordinal)) for p in postings]
+
+                if window is None:
+                    matched = phrase_match(position_lists, offsets)
+                else:
+                    matched = within_window(position_lists, window)
+
+                if matched:
+                    matches.add(ordinal)
+
+            candidates = matches if candidates is None else candidates & matches
+
+        return candidates
+
+    def __candidate_search(self, query_tokens, limit, stats, deleted, candidates):
+
+        token_postings = [(token, self.get_postings(token)) for token in query_tokens]
+        total = sum(len(postings) for postings in
+                    {token: postings for token, postings in token_postings if postings is not None}.values())
+
+        scores = []
+        scored = 0
+        for ordinal in sorted(candidates):
+
+            if ordinal in deleted: continue
+
+            score = 0.0
+            for token, postings in token_postings:
+
+                if postings is None: continue
+
+                pos = postings.find(ordinal)
+                if pos < 0: continue
+
+                score += self.__bm25(ordinal, token, postings.tfs[pos], stats)
+                scored += 1
+
+            scores.append((ordinal, score))
+
+        search_stats = {"postings_scored": scored, "postings_skipped": max(0, total - scored)}
+
+        scores.sort(key = lambda a: (-a[1], a[0]))
+
+        return scores[:limit], search_stats
+
+    def __exhaustive_search(self, query_tokens, limit, stats, deleted):
+
         scores = {}
+        scored = 0
 
         for token in query_tokens:
 
-            curr_score = 0
+            postings = self.get_postings(token)
+            if postings is None: continue
 
-            for doc_id in self.index.get(token, []):
+            for ordinal, tf in zip(postings.doc_ids, postings.tfs):
 
-                curr_score = self.bm25(doc_id, token)
+                if ordinal in deleted: continue
 
-                val = scores.get(doc_id, 0.0)
-                scores[doc_id] = val + curr_score
+                curr_score = self.__bm25(ordinal, token, tf, stats)
 
-        score_sort = sorted(scores.items(), key = lambda a: a[1], reverse = True)
+                val = scores.get(ordinal, 0.0)
+                scores[ordinal] = val + curr_score
+                scored += 1
 
-        i = 1
-        for curr_doc_id, curr_doc_score in score_sort[:limit]:
+        search_stats = {"postings_scored": scored, "postings_skipped": 0}
 
-            curr_doc = self.docmap[curr_doc_id]
+        score_sort = sorted(scores.items(), key = lambda a: (-a[1], a[0]))
 
-            i += 1
-        return score_sort[:limit]
+        return score_sort[:limit], search_stats
 
+    def __wand_search(self, query_tokens, limit, stats, deleted):
+        """Top-k BM25 with WAND dynamic pruning.
 
-    
-    def build(self, movies):
+        Cursors walk the doc-ordinal sorted postings of each query term. A
+        document is only scored when the summed per-term upper bounds of the
+        cursors at or before it can beat the current k-th best score;
+        everything else is skipped with a binary search. Ordinals follow doc
+        id order and ties break on them, so the ranking is identical to
+        exhaustive scoring.
+        """
 
-        for movie in movies:
+        query_counts = Counter(query_tokens)
+
+        cursors = []
+        for token, count in query_counts.items():
+
+            term_id = self.term_ids.get(token)
+            if term_id is None: continue
+
+            postings = self.postings[term_id]
+            upper_bound = count * self.__upper_bound(term_id, token, stats) * (1 + MAX_SCORE_SLACK)
+            cursors.append([postings.doc_ids[0], 0, postings, upper_bound, token])
+
+        total = sum(len(c[2]) for c in cursors)
+        scored = 0
+        top_k = []  # min-heap of (score, -ordinal), worst result on top
+
+        while cursors and limit > 0:
+
+            cursors.sort(key = lambda c: c[0])
+
+            threshold = top_k[0][0] if len(top_k) >= limit else 0.0
+
+            pivot = None
+            acc = 0.0
+            for i, cursor in enumerate(cursors):
+
+                acc += cursor[3]
+                if acc > threshold:
+                    pivot = i
+                    break
+
+            if pivot is None: break
+
+            pivot_doc = cursors[pivot][0]
+
+            if cursors[0][0] == pivot_doc and pivot_doc in deleted:
+
+                for cursor in cursors:
+                    if cursor[0] == pivot_doc:
+                        self.__advance(cursor, cursor[1] + 1)
+
+            elif cursors[0][0] == pivot_doc:
+
+                matched = {}
+                for cursor in cursors:
+                    if cursor[0] == pivot_doc:
+                        matched[cursor[4]] = self.__bm25(pivot_doc, cursor[4], cursor[2].tfs[cursor[1]], stats)
+                        self.__advance(cursor, cursor[1] + 1)
+
+                score = 0.0
+                for token in query_tokens:
+                    if token in matched:
+                        score += matched[token]
+
+                scored += len(matched)
+
+                entry = (score, -pivot_doc)
+                if len(top_k) < limit:
+                    heapq.heappush(top_k, entry)
+                elif entry > top_k[0]:
+                    heapq.heapreplace(top_k, entry)
+            else:
+
+                for cursor in cursors[:pivot]:
+                    self.__advance(cursor, bisect_left(cursor[2].doc_ids, pivot_doc, cursor[1]))
+
+            cursors = [c for c in cursors if c[1] < len(c[2])]
+
+        search_stats = {"postings_scored": scored, "postings_skipped": total - scored}
+
+        return [(-neg_ordinal, score) for score, neg_ordinal in sorted(top_k, key = lambda e: (-e[0], -e[1]))], search_stats
 
-            inp_text = f"{movie["title"]} {movie["description"]}"
+    def __advance(self, cursor, pos):
+
+        cursor[1] = pos
+        if pos < len(cursor[2]):
+            cursor[0] = cursor[2].doc_ids[pos]
+
+    def __finalize(self):
+
+        doc_freqs = {}
+        for term, term_id in self.term_ids.items():
+
+            self.postings[term_id].sort()
+            doc_freqs[term] = len(self.postings[term_id])
+
+        self.stats = CollectionStats(doc_freqs, self.doc_lengths, self.N)
+
+        self.max_scores = array("d", [0.0] * len(self.postings))
+        for term, term_id in self.term_ids.items():
+
+            postings = self.postings[term_id]
+            self.max_scores[term_id] = max(
+                    self.__bm25(ordinal, term, tf)
+                    for ordinal, tf in zip(postings.doc_ids, postings.tfs)
+                    )
+
+    def build(self, movies, workers = 1, positional = False):
+
+        self.positional = positional
+
+        for movie in movies:
 
-            self.__add_document(movie["id"], inp_text)
             self.docmap[movie["id"]] = movie
-            self.N += 1
 
-    def save(self):
+        self.doc_ids = array("I", sorted(self.docmap))
+        self.doc_lengths = array("d", [0.0] * len(self.doc_ids))
+        self.N = len(self.doc_ids)
+
+        ordinals = {doc_id: ordinal for ordinal, doc_id in enumerate(self.doc_ids)}
+
+        if workers > 1:
+
+            self.__build_parallel(movies, ordinals, workers)
+        else:
+
+            for movie in movies:
+
+                inp_text = f"{movie["title"]} {movie["description"]}"
+
+                self.__add_document(ordinals[movie["id"]], inp_text)
+
+        self.__finalize()
+
+    def __build_parallel(self, movies, ordinals, workers):
+        """Tokenize shards of the corpus in a process pool and merge them.
+
+        Each worker returns term -> PostingList for its shard. Postings are
+        concatenated in shard order and sorted by ordinal in __finalize, so
+        the result is identical to a serial build.
+        """
+
+        docs = [(ordinals[movie["id"]], f"{movie["title"]} {movie["description"]}") for movie in movies]
+
+        # A few shards per worker keeps the pool busy when shards tokenize unevenly.
+        shard_size = max(1, math.ceil(len(docs) / (workers * SHARDS_PER_WORKER)))
+        shards = [docs[i:i + shard_size] for i in range(0, len(docs), shard_size)]
+
+        with ProcessPoolExecutor(max_workers = workers, initializer = _init_shard_worker,
+                                 initargs = (self.stopwords, self.stemmer, self.positional)) as pool:
+
+            for shard_postings, shard_lengths in pool.map(_index_shard, shards):
+
+                for ordinal, doc_len in shard_lengths:
+                    self.doc_lengths[ordinal] = doc_len
+
+                for token, postings in shard_postings.items():
+
+                    merged = self.__term_postings(token)
+                    merged.doc_ids.extend(postings.doc_ids)
+                    merged.tfs.extend(postings.tfs)
+                    if self.positional:
+                        merged.positions.extend(postings.positions)
+                        merged.starts = None
+
+    def build_from_postings(self, docs, doc_lengths, term_postings, positional = False):
+        """Install prebuilt postings instead of tokenizing documents.
+
+        `docs` are the movies sorted by id, so list position is the doc
+        ordinal; `doc_lengths` is indexed by ordinal and `term_postings` maps
+        each term to a PostingList of ordinals.
+        """
+
+        self.positional = positional
+
+        self.docmap = {doc["id"]: doc for doc in docs}
+        self.doc_ids = array("I", (doc["id"] for doc in docs))
+        self.doc_lengths = array("d", doc_lengths)
+        self.N = len(self.doc_ids)
+
+        self.term_ids = {}
+        self.postings = []
+        for term, postings in term_postings.items():
+
+            self.term_ids[term] = len(self.postings)
+            self.postings.append(postings)
+
+        self.__finalize()
+
+    def save(self, path = INDEX_PATH):
+
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+
+        terms = sorted(self.term_ids, key = lambda t: t.encode())
+        term_ids = [self.term_ids[term] for term in terms]
+
+        write_index(
+                path,
+                terms,
+                [self.postings[term_id] for term_id in term_ids],
+                [len(self.postings[term_id]) for term_id in term_ids],
+                [self.max_scores[term_id] for term_id in term_ids],
+                self.doc_ids,
+                self.doc_lengths,
+                self.stats.length_norms,
+                self.stats.avg_doc_length,
+                (self.docmap[doc_id] for doc_id in self.doc_ids),
+                positional = self.positional,
+                )
+
+    def load(self, path = INDEX_PATH):
+
+        index_file = IndexFile(path)
+
+        self.index_file = index_file
+        self.term_ids = index_file.term_ids
+        self.postings = index_file.postings
+        self.max_scores = index_file.max_scores
+        self.positional = index_file.positional
+        self.doc_ids = index_file.doc_ids
+        self.doc_lengths = index_file.doc_lengths
+        self.docmap = index_file.docmap
+        self.N = index_file.num_docs
+        self.stats = CollectionStats(
+                index_file.doc_freqs,
+                self.doc_lengths,
+                self.N,
+                avg_doc_length = index_file.avg_doc_length,
+                length_norms = index_file.length_norms,
+                )
+
+_shard_index = None
+
+def _init_shard_worker(stopwords, stemmer, positional):
+
+    global _shard_index
+    _shard_index = InvertedIndex(stopwords, stemmer)
+    _shard_index.positional = positional
 
-        try:
-            os.mkdir("cache")
-        except FileExistsError:
-            print("dir cache exists")
+def _index_shard(docs):
 
-        with open("cache/index.pkl", "wb") as f_idx:
-            pickle.dump(self.index, f_idx)
-        with open("cache/docmap.pkl", "wb")as f_docmap:
-            pickle.dump(self.docmap, f_docmap)
-        with open("cache/term_frequencies.pkl", "wb") as f_term_freq:
-            pickle.dump(self.term_frequencies, f_term_freq)
-        with open("cache/doc_lengths.pkl", "wb") as f_doc_lengths:
-            pickle.dump(self.doc_lengths, f_doc_lengths)
+    shard_postings = {}
+    shard_lengths = []
 
-    def load(self):
+    positional = _shard_index.positional
 
-        try:
-            with open("cache/index.pkl", "rb") as f_idx:
-                self.index = pickle.load(f_idx)
-            with open("cache/docmap.pkl", "rb") as f_docmap:
-                self.docmap = pickle.load(f_docmap)
-            with open("cache/term_frequencies.pkl", "rb") as f_term_freq:
-                self.term_frequencies = pickle.load(f_term_freq)
-            with open("cache/doc_lengths.pkl", "rb") as f_doc_lengths:
-                self.doc_lengths = pickle.load(f_doc_lengths)
+    for ordinal, text in docs:
 
-            self.N = len(self.docmap.keys())
+        doc_len, terms = document_terms(_shard_index.analyzer, text, positional)
 
-        except Exception as e:
+        for token, tf, positions in terms:
 
-            raise Exception(e)
+            postings = shard_postings.get(token)
+            if postings is None:
+                postings = shard_postings[token] = PostingList.positional() if positional else PostingList()
+            postings.append(ordinal, tf, positions)
 
-        
+        shard_lengths.append((ordinal, float(doc_len)))
 
+    return shard_postings, shard_lengths
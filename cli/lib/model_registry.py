@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+
+BI_ENCODER_MODEL = "all-MiniLM-L6-v2"
+CLIP_MODEL = "clip-ViT-B-32"
+CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-TinyBERT-L2-v2"
+
+# Models kept loaded at once; the least recently used one is dropped first.
+MAX_RESIDENT_MODELS = 3
+
+# sentence_transformers class that loads each kind of model.
+LOADERS = {
+        "sentence_transformer": "SentenceTransformer",
+        "cross_encoder": "CrossEncoder",
+        }
+
+def load_model(name, kind):
+
+    # Imported on first load: torch takes seconds to import, which CLIs
+    # that forward queries to the search server never need to pay.
+    import sentence_transformers
+
+    return getattr(sentence_transformers, LOADERS[kind])(name)
+
+def model_memory(model):
+    """Bytes held by a torch-backed model's parameters and buffers."""
+
+    module = model if hasattr(model, "parameters") else getattr(model, "model", None)
+    if module is None or not hasattr(module, "parameters"): return 0
+
+    tensors = list(module.parameters()) + list(module.buffers())
+
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+def warm_up_model(model, kind):
+    """Run one tiny inference so lazy initialization happens before real traffic."""
+
+    if kind == "cross_encoder":
+        model.predict([["warm up", "warm up"]], show_progress_bar = False)
+    else:
+        model.encode(["warm up"], show_progress_bar = False)
+
+class ModelRegistry:
+    """Loads each model at most once per process and shares it.
+
+    get() returns the resident instance or loads it. Concurrent callers
+    asking for the same model wait for one load instead of each loading
+    it, and different models can load in parallel. Inference on the shared
+    models is read-only and safe to run from several threads. At most
+    `max_models` stay resident (LRU). Eviction only frees a model nobody
+    else references, so callers call get() on each use instead of keeping
+    the instance. Per-model load time, memory and hit counts are kept in
+    metrics().
+    """
+
+    def __init__(self, max_models = MAX_RESIDENT_MODELS):
+
+        self.max_models = max_models
+        self.lock = threading.Lock()
+        self.models = OrderedDict()
+        self.load_locks = {}
+        self.stats = {}
+
+    def get(self, name, kind = "sentence_transformer"):
+
+        key = (kind, name)
+
+        with self.lock:
+            model = self.__hit(key)
+            if model is not None: return model
+            load_lock = self.load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+
+            with self.lock:
+                model = self.__hit(key)
+                if model is not None: return model
+
+            start = time.perf_counter()
+            model = load_model(name, kind)
+            load_seconds = time.perf_counter() - start
+
+            with self.lock:
+
+                stats = self.stats.setdefault(key, {"loads": 0, "hits": 0, "evictions": 0})
+                stats["loads"] += 1
+                stats["load_seconds"] = load_seconds
+                stats["memory_bytes"] = model_memory(model)
+
+                self.models[key] = model
+                while len(self.models) > self.max_models:
+                    evicted, _ = self.models.popitem(last = False)
+                    self.stats[evicted]["evictions"] += 1
+
+        return model
+
+    def __hit(self, key):
+
+        model = self.models.get(key)
+
+        if model is not None:
+            self.models.move_to_end(key)
+            self.stats[key]["hits"] += 1
+
+        return model
+
+    def warm_up(self, models):
+        """Load and warm (name, kind) pairs, e.g. at server start."""
+
+        for name, kind in models:
+
+            model = self.get(name, kind)
+
+            start = time.perf_counter()
+            warm_up_model(model, kind)
+
+            with self.lock:
+                self.stats[(kind, name)]["warm_up_seconds"] = time.perf_counter() - start
+
+    def metrics(self):
+
+        with self.lock:
+            return [
+                    {"name": name, "kind": kind, "resident": (kind, name) in self.models, **stats}
+                    for (kind, name), stats in self.stats.items()
+                    ]
+
+registry = ModelRegistry()
+
+def get_model(name, kind = "sentence_transformer"):
+
+    return registry.get(name, kind)
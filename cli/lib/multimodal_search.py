@@ -1,18 +1,23 @@
 import json
 import numpy as np
 from PIL import Image
-from sentence_transformers import SentenceTransformer
 from .semantic_search import cosine_similarity
+from .model_registry import get_model, CLIP_MODEL
 
 class MultimodalSearch:
-    def __init__(self, documents, model_name="clip-ViT-B-32"):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, documents, model_name=CLIP_MODEL):
+        self.model_name = model_name
         self.documents = documents
         self.texts = [f"{doc.get('title', '')}: {doc.get('description', '')}" for doc in documents]
         print("Generating text embeddings for multimodal search...")
         self.text_embeddings = self.model.encode(self.texts, show_progress_bar=True)
         print(f"Generated {len(self.text_embeddings)} text embeddings.")
 
+    @property
+    def model(self):
+        # From the registry on each use, so an evicted model is not kept alive here.
+        return get_model(self.model_name)
+
     def embed_image(self, image_path):
         try:
             img = Image.open(image_path)
@@ -0,0 +1,64 @@
+import os
+import struct
+import numpy as np
+
+# Bytes reserved for the .npy header, so the final shape can be written
+# over the placeholder without moving the data.
+HEADER_SIZE = 256
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+
+class NpyAppender:
+    """Writes a .npy file whose row count is not known up front.
+
+    Rows are appended raw after a fixed-size header; close() writes the
+    final shape into the header and moves the file into place, so readers
+    never see a partial file. abort() drops it instead.
+    """
+
+    def __init__(self, path, dtype, row_shape = ()):
+
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.rows = 0
+        self.tmp_path = f"{path}.tmp"
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+        self.file = open(self.tmp_path, "wb")
+        self.file.write(self.__header())
+
+    def __header(self):
+
+        header = repr({"descr": np.lib.format.dtype_to_descr(self.dtype), "fortran_order": False,
+                       "shape": (self.rows,) + self.row_shape})
+
+        size = HEADER_SIZE - len(NPY_MAGIC) - 2
+        if len(header) >= size: raise Exception(f"npy header too long for {self.path}")
+
+        return NPY_MAGIC + struct.pack("<H", size) + (header.ljust(size - 1) + "\n").encode("latin1")
+
+    def append(self, rows):
+
+        rows = np.ascontiguousarray(rows, dtype = self.dtype)
+        if rows.shape[1:] != self.row_shape:
+            raise ValueError(f"rows of shape {rows.shape[1:]} appended to {self.path}, expected {self.row_shape}")
+
+        self.file.write(rows.tobytes())
+        self.rows += len(rows)
+
+    def close(self):
+        """Finish the file and return a read-only memory map of it."""
+
+        self.file.seek(0)
+        self.file.write(self.__header())
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+        return np.load(self.path, mmap_mode = "r")
+
+    def abort(self):
+
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
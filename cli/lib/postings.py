@@ -0,0 +1,250 @@
+import heapq
+from array import array
+from bisect import bisect_left
+
+# Unsigned 32-bit typecode; 'I' is 4 bytes on every platform we build on.
+POSTING_TYPECODE = "I"
+
+def encode_varints(values, out: bytearray) -> bytearray:
+
+    for value in values:
+
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+
+    return out
+
+def decode_varints(buf, count: int, pos: int = 0):
+
+    values = array(POSTING_TYPECODE)
+
+    for _ in range(count):
+
+        value = 0
+        shift = 0
+        while True:
+            byte = buf[pos]
+            pos += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80: break
+            shift += 7
+        values.append(value)
+
+    return values, pos
+
+def gallop(values, target, lo: int = 0) -> int:
+    """First index >= lo whose value is >= target, probing 1, 2, 4, ... ahead."""
+
+    step = 1
+    hi = lo
+    while hi < len(values) and values[hi] < target:
+        lo = hi + 1
+        hi += step
+        step <<= 1
+
+    return bisect_left(values, target, lo, min(hi, len(values)))
+
+def intersect(lists):
+    """Values present in every sorted list, galloping through the longer ones."""
+
+    if not lists: return []
+
+    lists = sorted(lists, key = len)
+    cursors = [0] * len(lists)
+    result = []
+
+    for value in lists[0]:
+
+        found = True
+        for i in range(1, len(lists)):
+
+            cursors[i] = gallop(lists[i], value, cursors[i])
+            if cursors[i] >= len(lists[i]): return result
+            if lists[i][cursors[i]] != value:
+                found = False
+                break
+
+        if found:
+            result.append(value)
+
+    return result
+
+def phrase_match(position_lists, offsets) -> bool:
+    """True if some p has p + offsets[i] in position_lists[i] for every i."""
+
+    cursors = [0] * len(position_lists)
+
+    for start in position_lists[0]:
+
+        base = start - offsets[0]
+        found = True
+        for i in range(1, len(position_lists)):
+
+            target = base + offsets[i]
+            cursors[i] = gallop(position_lists[i], target, cursors[i])
+            if cursors[i] >= len(position_lists[i]): return False
+            if position_lists[i][cursors[i]] != target:
+                found = False
+                break
+
+        if found: return True
+
+    return False
+
+def within_window(position_lists, window: int) -> bool:
+    """True if one occurrence of every list fits in a span of `window` positions."""
+
+    heap = [(positions[0], i, 0) for i, positions in enumerate(position_lists)]
+    heapq.heapify(heap)
+    highest = max(entry[0] for entry in heap)
+
+    while True:
+
+        lowest, i, pos = heap[0]
+        if highest - lowest <= window: return True
+
+        pos += 1
+        if pos >= len(position_lists[i]): return False
+
+        nxt = position_lists[i][pos]
+        highest = max(highest, nxt)
+        heapq.heapreplace(heap, (nxt, i, pos))
+
+class PostingList:
+    """Doc-id sorted postings for one term in contiguous typed arrays.
+
+    doc_ids[i] holds a document containing the term and tfs[i] its term
+    frequency there. A positional list also keeps every occurrence's word
+    position in one flat `positions` array, tfs[i] entries per posting. On
+    disk the doc ids and each posting's positions are delta encoded and
+    everything is written as varints.
+    """
+
+    __slots__ = ("doc_ids", "tfs", "positions", "starts")
+
+    def __init__(self, doc_ids = None, tfs = None, positions = None):
+
+        self.doc_ids = doc_ids if doc_ids is not None else array(POSTING_TYPECODE)
+        self.tfs = tfs if tfs is not None else array(POSTING_TYPECODE)
+        self.positions = positions
+        self.starts = None
+
+    @classmethod
+    def positional(cls):
+
+        return cls(positions = array(POSTING_TYPECODE))
+
+    def __len__(self):
+
+        return len(self.doc_ids)
+
+    def append(self, doc_id: int, tf: int, positions = None):
+
+        self.doc_ids.append(doc_id)
+        self.tfs.append(tf)
+        if self.positions is not None:
+            self.positions.extend(positions)
+            self.starts = None
+
+    def extend(self, other):
+
+        for i in range(len(other)):
+            self.append(other.doc_ids[i], other.tfs[i],
+                        other.positions_at(i) if self.positions is not None else None)
+
+    def positions_at(self, i: int):
+
+        starts = self.starts
+
+        if starts is None:
+
+            # Built aside and published once: readers on other threads never
+            # see a partial prefix sum.
+            starts = array("Q", [0])
+            for tf in self.tfs:
+                starts.append(starts[-1] + tf)
+            self.starts = starts
+
+        return self.positions[starts[i]:starts[i + 1]]
+
+    def sort(self):
+
+        if all(a < b for a, b in zip(self.doc_ids, self.doc_ids[1:])): return
+
+        order = sorted(range(len(self.doc_ids)), key = lambda i: self.doc_ids[i])
+
+        if self.positions is not None:
+            positions = array(POSTING_TYPECODE)
+            for i in order:
+                positions.extend(self.positions_at(i))
+            self.positions = positions
+            self.starts = None
+
+        self.doc_ids = array(POSTING_TYPECODE, (self.doc_ids[i] for i in order))
+        self.tfs = array(POSTING_TYPECODE, (self.tfs[i] for i in order))
+
+    def find(self, doc_id: int) -> int:
+
+        pos = bisect_left(self.doc_ids, doc_id)
+        if pos < len(self.doc_ids) and self.doc_ids[pos] == doc_id:
+            return pos
+
+        return -1
+
+    def tf(self, doc_id: int) -> int:
+
+        pos = self.find(doc_id)
+
+        return self.tfs[pos] if pos >= 0 else 0
+
+    def encode(self, out: bytearray = None) -> bytearray:
+
+        out = out if out is not None else bytearray()
+
+        encode_varints((len(self.doc_ids),), out)
+        encode_varints(deltas(self.doc_ids), out)
+        encode_varints(self.tfs, out)
+
+        if self.positions is not None:
+            for i in range(len(self.doc_ids)):
+                encode_varints(deltas(self.positions_at(i)), out)
+
+        return out
+
+    @classmethod
+    def decode(cls, buf, pos: int = 0, with_positions: bool = False):
+
+        (count,), pos = decode_varints(buf, 1, pos)
+
+        doc_ids, pos = decode_varints(buf, count, pos)
+        undelta(doc_ids)
+
+        tfs, pos = decode_varints(buf, count, pos)
+
+        positions = None
+        if with_positions:
+            positions, pos = decode_varints(buf, sum(tfs), pos)
+            start = 0
+            for tf in tfs:
+                undelta(positions, start, start + tf)
+                start += tf
+
+        return cls(doc_ids, tfs, positions), pos
+
+def deltas(values):
+
+    prev = 0
+    out = []
+    for value in values:
+        out.append(value - prev)
+        prev = value
+
+    return out
+
+def undelta(values, start: int = 0, end: int = None):
+
+    end = len(values) if end is None else end
+    for i in range(start + 1, end):
+        values[i] += values[i - 1]
@@ -0,0 +1,133 @@
+import os
+import numpy as np
+from .ann_index import file_stamp
+
+QUANTIZATION_MODES = ("float16", "int8")
+
+# Rows dequantized per block when scoring, to bound temporary float32 memory.
+SCORE_BLOCK = 1 << 15
+
+class QuantizedMatrix:
+    """Compressed copy of L2-normalized embeddings for a first scoring pass.
+
+    float16 halves the matrix. int8 stores per-dimension scales with
+    codes in [-127, 127], so the matrix is a quarter of the float32 size;
+    a query is scored as codes @ (scales * query) without ever
+    dequantizing the whole matrix. Indexing returns dequantized float32
+    rows, so the matrix can stand in for the normalized embeddings.
+    """
+
+    def __init__(self, mode, codes, scales = None, source_stamp = None):
+
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"unknown quantization mode {mode}, expected one of {QUANTIZATION_MODES}")
+
+        self.mode = mode
+        self.codes = codes
+        self.scales = scales
+        self.source_stamp = source_stamp
+
+    @classmethod
+    def quantize(cls, vectors, mode, source_stamp = None):
+
+        vectors = np.asarray(vectors, dtype = np.float32)
+
+        if mode == "float16":
+            return cls(mode, vectors.astype(np.float16), source_stamp = source_stamp)
+
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"unknown quantization mode {mode}, expected one of {QUANTIZATION_MODES}")
+
+        scales = np.abs(vectors).max(axis = 0) / 127.0 if len(vectors) else np.ones(vectors.shape[1:])
+        scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+        codes = np.clip(np.rint(vectors / scales), -127, 127).astype(np.int8)
+
+        return cls(mode, codes, scales, source_stamp)
+
+    def __len__(self):
+
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __getitem__(self, key):
+
+        rows = self.codes[key].astype(np.float32)
+        if self.scales is not None:
+            rows *= self.scales
+
+        return rows
+
+    def __matmul__(self, query):
+        """Scores for one query (d,) or a batch of query columns (d, b)."""
+
+        query = np.asarray(query, dtype = np.float32)
+        if self.scales is not None:
+            query = query * (self.scales if query.ndim == 1 else self.scales[:, None])
+
+        scores = np.empty((len(self.codes),) + query.shape[1:], dtype = np.float32)
+        for start in range(0, len(self.codes), SCORE_BLOCK):
+            scores[start:start + SCORE_BLOCK] = self.codes[start:start + SCORE_BLOCK].astype(np.float32) @ query
+
+        return scores
+
+    def save(self, path):
+
+        arrays = {"codes": self.codes, "mode": np.array(self.mode),
+                  "source_stamp": np.array(self.source_stamp or (0, 0), dtype = np.int64)}
+        if self.scales is not None:
+            arrays["scales"] = self.scales
+
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+
+        with np.load(path) as data:
+            return cls(str(data["mode"]), data["codes"], data["scales"] if "scales" in data else None,
+                       tuple(int(v) for v in data["source_stamp"]))
+
+def quantized_path(path, mode):
+
+    return f"{os.path.splitext(path)[0]}.{mode}.npz"
+
+def load_or_quantize(path, count, normalized, mode):
+    """The `mode` quantization of the `count` embeddings saved at `path`.
+
+    A cached quantization is reused only if it was made from the current
+    version of `path`; otherwise `normalized()` is called for the
+    L2-normalized embeddings and they are quantized and cached.
+    """
+
+    stamp = file_stamp(path) if os.path.exists(path) else None
+    cache_path = quantized_path(path, mode)
+
+    if stamp is not None and os.path.exists(cache_path):
+        quantized = QuantizedMatrix.load(cache_path)
+        if quantized.source_stamp == stamp and len(quantized) == count:
+            return quantized
+
+    quantized = QuantizedMatrix.quantize(normalized(), mode, stamp)
+    if stamp is not None:
+        quantized.save(cache_path)
+
+    return quantized
+
+def rescore(candidate_scores, candidate_ids, full_vectors, query, count):
+    """Exact (ids, scores) for the `count` best candidates of a quantized pass.
+
+    `full_vectors` are the normalized float32 embeddings, typically
+    memory-mapped, so only the chosen rows are read. Ids come back ascending.
+    """
+
+    count = min(count, len(candidate_scores))
+    top = np.argpartition(-candidate_scores, count - 1)[:count] if count > 0 else np.zeros(0, dtype = np.int64)
+
+    ids = np.sort(candidate_ids[top] if candidate_ids is not None else top)
+
+    return ids, np.asarray(full_vectors[ids], dtype = np.float32) @ query
@@ -0,0 +1,179 @@
+import atexit
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+QUERY_CACHE_DIR = "cache/query_embeddings"
+QUERY_CACHE_SIZE = 4096
+QUERY_CACHE_TTL = 24 * 60 * 60
+
+# Most-hit entries written to disk for the next process to start warm.
+PERSIST_COUNT = 512
+
+def normalize_query(text):
+
+    return " ".join(text.lower().split())
+
+def query_cache_path(model_name):
+
+    return os.path.join(QUERY_CACHE_DIR, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name) + ".npz")
+
+class QueryEmbeddingCache:
+    """LRU of normalized query text -> embedding with a TTL.
+
+    Lookups move an entry to the most recently used end; entries older
+    than `ttl` seconds count as misses and are dropped. With a
+    `persist_path` the `persist_count` most-hit live entries are saved at
+    exit (or on save()) and loaded back by the next process.
+    """
+
+    def __init__(self, max_size = QUERY_CACHE_SIZE, ttl = QUERY_CACHE_TTL, persist_path = None,
+                 persist_count = PERSIST_COUNT):
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist_path = persist_path
+        self.persist_count = persist_count
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if persist_path:
+            self.load()
+            atexit.register(self.save)
+
+    def get(self, text, compute):
+        """The cached embedding for `text`, or compute(text) stored under it."""
+
+        key = normalize_query(text)
+        now = time.time()
+
+        with self.lock:
+
+            entry = self.entries.get(key)
+
+            if entry is not None and now - entry[1] <= self.ttl:
+                self.entries.move_to_end(key)
+                entry[2] += 1
+                self.hits += 1
+                return entry[0]
+
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+
+        embedding = compute(text)
+
+        with self.lock:
+
+            self.entries[key] = [embedding, now, 0]
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last = False)
+
+        return embedding
+
+    def get_many(self, texts, compute_many):
+        """Cached embeddings for `texts`; the misses go to compute_many(list) in one call."""
+
+        keys = [normalize_query(text) for text in texts]
+        now = time.time()
+        found = {}
+
+        with self.lock:
+
+            for key in keys:
+
+                if key in found: continue
+
+                entry = self.entries.get(key)
+
+                if entry is not None and now - entry[1] <= self.ttl:
+                    self.entries.move_to_end(key)
+                    entry[2] += 1
+                    self.hits += 1
+                    found[key] = entry[0]
+                    continue
+
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+
+        if missing:
+
+            embeddings = compute_many(list(missing.values()))
+
+            with self.lock:
+
+                for key, embedding in zip(missing, embeddings):
+                    found[key] = embedding
+                    self.entries[key] = [embedding, now, 0]
+                    self.entries.move_to_end(key)
+
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last = False)
+
+        return [found[key] for key in keys]
+
+    def stats(self):
+
+        with self.lock:
+
+            lookups = self.hits + self.misses
+
+            return {
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "size": len(self.entries),
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    }
+
+    def save(self):
+
+        if not self.persist_path: return
+
+        now = time.time()
+        with self.lock:
+            live = [(key, entry) for key, entry in self.entries.items() if now - entry[1] <= self.ttl]
+
+        hottest = sorted(live, key = lambda a: a[1][2], reverse = True)[:self.persist_count]
+        if not hottest: return
+
+        os.makedirs(os.path.dirname(self.persist_path) or ".", exist_ok = True)
+
+        tmp_path = f"{self.persist_path}.tmp.npz"
+        np.savez(tmp_path,
+                 queries = np.array([key for key, _ in hottest]),
+                 embeddings = np.stack([entry[0] for _, entry in hottest]),
+                 created = np.array([entry[1] for _, entry in hottest]),
+                 hits = np.array([entry[2] for _, entry in hottest]))
+        os.replace(tmp_path, self.persist_path)
+
+    def load(self):
+
+        if not self.persist_path or not os.path.exists(self.persist_path): return
+
+        now = time.time()
+
+        with np.load(self.persist_path) as data:
+
+            rows = zip(data["queries"], data["embeddings"], data["created"], data["hits"])
+
+            with self.lock:
+
+                # Coldest first so the hottest end up most recently used.
+                for query, embedding, created, hits in sorted(rows, key = lambda a: a[3]):
+                    if now - created <= self.ttl:
+                        self.entries[str(query)] = [embedding, float(created), int(hits)]
+
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last = False)
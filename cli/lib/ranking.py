@@ -0,0 +1,17 @@
+import numpy as np
+
+def top_k_indices(scores, limit):
+    """Indices of the `limit` highest scores, best first, ties by index."""
+
+    k = min(limit, len(scores))
+    if k <= 0: return np.zeros(0, dtype = np.int64)
+
+    top = np.argpartition(-scores, k - 1)[:k]
+    kth = scores[top].min()
+
+    # argpartition picks arbitrarily among entries tied with the k-th score.
+    above = top[scores[top] > kth]
+    tied = np.flatnonzero(scores == kth)[:k - len(above)]
+    top = np.concatenate((above, tied))
+
+    return top[np.lexsort((top, -scores[top]))]
@@ -0,0 +1,200 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from .query_cache import normalize_query
+from .search_client import to_json
+
+RESULT_CACHE_DIR = "cache/hybrid_results"
+RESULT_CACHE_SIZE = 1024
+RESULT_CACHE_TTL = 60 * 60
+
+# Entries kept on disk per version; the least recently written go first.
+DISK_MAX_ENTRIES = 4096
+
+def version_stamp(paths):
+    """Hash of the size and mtime of every existing file in `paths`.
+
+    Rebuilding an index or the embeddings changes it, which retires every
+    result cached under the old stamp.
+    """
+
+    h = hashlib.blake2b(digest_size = 8)
+
+    for path in paths:
+        if os.path.exists(path):
+            st = os.stat(path)
+            h.update(f"{path}:{st.st_size}:{st.st_mtime_ns};".encode())
+
+    return h.hexdigest()
+
+def result_key(kind, query, params):
+
+    text = json.dumps([kind, normalize_query(query), sorted(params.items())])
+
+    return hashlib.blake2b(text.encode(), digest_size = 16).hexdigest()
+
+class HybridResultCache:
+    """Results of whole hybrid queries, keyed on query, parameters and data version.
+
+    The key is the normalized query plus every parameter that changes
+    the results, under the version_stamp() of `source_paths`. Memory
+    holds an LRU of `max_size` entries that expire after `ttl` seconds.
+    With `persist_dir` each entry is also written there as JSON, so later
+    processes get hits too. When the stamp changes, the memory tier is
+    cleared and the disk entries of other versions are removed. Every hit
+    adds the time the original computation took, minus the lookup, to
+    stats()["seconds_saved"].
+    """
+
+    def __init__(self, source_paths, max_size = RESULT_CACHE_SIZE, ttl = RESULT_CACHE_TTL, persist_dir = None):
+
+        self.source_paths = source_paths
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist_dir = persist_dir
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+    def get(self, kind, query, params, compute):
+        """Cached results for (kind, query, params), or those of compute() stored under them.
+
+        compute() returns (results, cacheable). Results it marks as not
+        cacheable, e.g. a degraded answer, are returned but not stored.
+        The flag comes back with this call's results, so concurrent
+        queries cannot change it.
+        """
+
+        start = time.perf_counter()
+        version = self.__check_version()
+        key = result_key(kind, query, params)
+
+        entry = self.__lookup(version, key)
+
+        if entry is not None:
+            saved = max(0.0, entry["seconds"] - (time.perf_counter() - start))
+            with self.lock:
+                self.seconds_saved += saved
+            logging.debug(f"{kind} result cache hit, saved {saved:.3f}s")
+            return copy.deepcopy(entry["results"])
+
+        with self.lock:
+            self.misses += 1
+
+        results, cacheable = compute()
+        if not cacheable: return results
+
+        entry = {"results": copy.deepcopy(results), "created": time.time(),
+                 "seconds": time.perf_counter() - start}
+
+        self.__store(version, key, entry)
+
+        return results
+
+    def __check_version(self):
+
+        version = version_stamp(self.source_paths)
+
+        with self.lock:
+            if version == self.version: return version
+            self.version = version
+            self.entries.clear()
+
+        if self.persist_dir and os.path.isdir(self.persist_dir):
+            for name in os.listdir(self.persist_dir):
+                if name != version:
+                    shutil.rmtree(os.path.join(self.persist_dir, name), ignore_errors = True)
+
+        return version
+
+    def __lookup(self, version, key):
+
+        now = time.time()
+
+        with self.lock:
+
+            entry = self.entries.get(key)
+
+            if entry is not None and now - entry["created"] <= self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+            if entry is not None:
+                del self.entries[key]
+
+        if not self.persist_dir: return None
+
+        path = os.path.join(self.persist_dir, version, f"{key}.json")
+
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if now - entry["created"] > self.ttl: return None
+
+        with self.lock:
+            self.__remember(key, entry)
+            self.hits += 1
+            self.disk_hits += 1
+
+        return entry
+
+    def __remember(self, key, entry):
+
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last = False)
+
+    def __store(self, version, key, entry):
+
+        with self.lock:
+            self.__remember(key, entry)
+
+        if not self.persist_dir: return
+
+        version_dir = os.path.join(self.persist_dir, version)
+        os.makedirs(version_dir, exist_ok = True)
+
+        path = os.path.join(version_dir, f"{key}.json")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f, default = to_json)
+        os.replace(tmp_path, path)
+
+        names = os.listdir(version_dir)
+        if len(names) > DISK_MAX_ENTRIES:
+            paths = sorted((os.path.join(version_dir, name) for name in names), key = os.path.getmtime)
+            for old_path in paths[:len(paths) - DISK_MAX_ENTRIES]:
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+
+    def stats(self):
+
+        with self.lock:
+
+            lookups = self.hits + self.misses
+
+            return {
+                    "hits": self.hits,
+                    "disk_hits": self.disk_hits,
+                    "misses": self.misses,
+                    "size": len(self.entries),
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "seconds_saved": self.seconds_saved,
+                    }
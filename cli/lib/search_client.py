@@ -0,0 +1,67 @@
+import http.client
+import json
+import os
+from urllib.parse import urlsplit
+
+# Where CLIs look for a running search server; set it to "" to always search locally.
+SERVER_URL_ENV = "SEARCH_SERVER_URL"
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Seconds to wait for a connection before searching locally instead.
+CONNECT_TIMEOUT = 0.2
+
+# Seconds to wait for an answer; RAG queries wait on the LLM.
+REQUEST_TIMEOUT = 300
+
+def server_url():
+
+    return os.environ.get(SERVER_URL_ENV, f"http://{DEFAULT_HOST}:{DEFAULT_PORT}")
+
+def remote_call(endpoint, payload):
+    """The running server's answer to POST /<endpoint>, or None if no server is up.
+
+    This module only uses the standard library, so a CLI can try the
+    server before importing the search code and loading any models.
+    """
+
+    return server_request("POST", f"/{endpoint}", payload)
+
+def server_health():
+
+    return server_request("GET", "/health")
+
+def to_json(value):
+    """json.dumps fallback for numpy scalars in results."""
+
+    if hasattr(value, "item"): return value.item()
+
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def server_request(method, path, payload = None):
+
+    url = server_url()
+    if not url: return None
+
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or DEFAULT_PORT, timeout = CONNECT_TIMEOUT)
+
+    try:
+        conn.connect()
+    except OSError:
+        return None
+
+    try:
+        conn.sock.settimeout(REQUEST_TIMEOUT)
+        body = json.dumps(payload) if payload is not None else None
+        conn.request(method, path, body, {"Content-Type": "application/json"})
+
+        response = conn.getresponse()
+        answer = json.loads(response.read() or b"{}")
+    finally:
+        conn.close()
+
+    if response.status != 200:
+        raise Exception(f"search server: {answer.get("error", response.reason)}")
+
+    return answer
@@ -0,0 +1,146 @@
+import json
+import logging
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from .hybrid_search import load_hybrid_search, weighted_search, rrf_search
+from .semantic_search import SemanticSearch
+from .augmented_generation import perform_rag, perform_summary, perform_rag_with_citations, perform_question_answering
+from .model_registry import registry, BI_ENCODER_MODEL
+from .search_client import DEFAULT_HOST, DEFAULT_PORT, to_json
+
+ENDPOINTS = ("keyword", "semantic", "weighted", "rrf", "rag")
+
+RAG_MODES = {
+        "summarize": perform_summary,
+        "citations": perform_rag_with_citations,
+        "question": perform_question_answering,
+        }
+
+class SearchService:
+    """Movies, BM25 segments, embeddings and models, loaded once.
+
+    Each method answers one endpoint of the JSON API from memory. The
+    BM25 segments are re-read only when another process changed them.
+    """
+
+    def __init__(self):
+
+        self.hybrid = load_hybrid_search()
+        self.movie_search = SemanticSearch(persist_query_cache = True)
+        self.movie_search.load_or_create_embeddings(self.hybrid.documents)
+        self.started = time.time()
+
+        registry.warm_up([(BI_ENCODER_MODEL, "sentence_transformer")])
+
+    def keyword(self, query, limit = 5):
+
+        idx = self.hybrid.idx
+        idx.refresh()
+
+        # Stats come back with this query's results; last_search_stats is
+        # shared by every request thread.
+        results, search_stats = idx.bm25_search_with_stats(query, int(limit))
+
+        return {
+                "results": [{"id": doc_id, "title": idx.docmap[doc_id]["title"], "score": score}
+                            for doc_id, score in results],
+                "stats": search_stats,
+                }
+
+    def semantic(self, query, limit = 5, chunked = True, nprobe = 0):
+
+        if chunked:
+            return {"results": self.hybrid.semantic_search.search_chunks(query, limit, nprobe)}
+
+        return {"results": self.movie_search.search(query, limit)}
+
+    def weighted(self, query, alpha = 0.5, limit = 5):
+
+        legs = {}
+        results = weighted_search(query, alpha, limit, self.hybrid, legs)
+
+        return {"results": results, "legs": legs}
+
+    def rrf(self, query, k = 60, limit = 5, enhance = "", rerank = ""):
+
+        legs = {}
+        results = rrf_search(query, k, limit, enhance, rerank, self.hybrid, legs)
+
+        return {"results": results, "legs": legs}
+
+    def rag(self, query, mode = "rag", limit = 5):
+
+        if mode == "rag":
+            results, answer, error = perform_rag(query, self.hybrid)
+        elif mode in RAG_MODES:
+            results, answer, error = RAG_MODES[mode](query, limit, self.hybrid)
+        else:
+            raise ValueError(f"unknown rag mode {mode}, expected rag or one of {tuple(RAG_MODES)}")
+
+        return {"results": results, "answer": answer, "error": error}
+
+    def health(self):
+
+        return {"status": "ok", "uptime": time.time() - self.started, "models": registry.metrics(),
+                "result_cache": self.hybrid.result_cache.stats()}
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    """POST /<endpoint> with a JSON object of arguments; GET /health."""
+
+    def do_GET(self):
+
+        if self.path == "/health":
+            self.__reply(200, self.server.service.health())
+        else:
+            self.__reply(404, {"error": f"no such path {self.path}"})
+
+    def do_POST(self):
+
+        endpoint = self.path.strip("/")
+        if endpoint not in ENDPOINTS:
+            self.__reply(404, {"error": f"no such endpoint {endpoint}, expected one of {ENDPOINTS}"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            answer = getattr(self.server.service, endpoint)(**payload)
+        except (TypeError, ValueError) as e:
+            self.__reply(400, {"error": str(e)})
+            return
+        except Exception as e:
+            logging.exception(f"{endpoint} failed")
+            self.__reply(500, {"error": str(e)})
+            return
+
+        self.__reply(200, answer)
+
+    def __reply(self, status, answer):
+
+        body = json.dumps(answer, default = to_json).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+
+        logging.debug(f"{self.address_string()} {format % args}")
+
+def serve(host = DEFAULT_HOST, port = DEFAULT_PORT):
+
+    start = time.perf_counter()
+    service = SearchService()
+
+    server = ThreadingHTTPServer((host, port), SearchRequestHandler)
+    server.service = service
+    print(f"Loaded in {time.perf_counter() - start:.1f}s, serving on http://{host}:{port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,458 @@
+import json
+import os
+import threading
+from array import array
+from collections.abc import Mapping
+from .keyword_search import InvertedIndex, CollectionStats, CACHE_DIR, INDEX_PATH, parse_query
+from .postings import PostingList
+from .analyzer import Analyzer
+
+SEGMENTS_DIR = os.path.join(CACHE_DIR, "segments")
+MANIFEST_PATH = os.path.join(SEGMENTS_DIR, "manifest.json")
+
+# Start a background merge once this many segments are live.
+MAX_SEGMENTS = 8
+
+class Segment:
+    """One immutable on-disk index plus the doc ids deleted from it since.
+
+    `deleted` is a frozenset replaced on every delete, so readers on other
+    threads iterate a consistent snapshot without taking the index lock.
+    """
+
+    def __init__(self, path, index, tombstones = ()):
+
+        self.path = path
+        self.index = index
+        self.tombstones = set(tombstones)
+        self.deleted = frozenset()
+        self.length_sum = 0.0
+        self.non_empty = 0
+
+        for doc_len in index.doc_lengths:
+            if doc_len:
+                self.length_sum += doc_len
+                self.non_empty += 1
+
+        self.__delete(self.tombstones)
+
+    def __delete(self, doc_ids):
+
+        ordinals = set()
+
+        for doc_id in doc_ids:
+
+            ordinal = self.index.ordinal(doc_id)
+            if ordinal < 0 or ordinal in self.deleted or ordinal in ordinals: continue
+
+            ordinals.add(ordinal)
+
+            doc_len = self.index.doc_lengths[ordinal]
+            if doc_len:
+                self.length_sum -= doc_len
+                self.non_empty -= 1
+
+        if ordinals:
+            self.deleted = self.deleted | ordinals
+
+    def delete(self, doc_id):
+
+        self.tombstones.add(doc_id)
+        self.__delete((doc_id,))
+
+    def has_live(self, doc_id):
+
+        ordinal = self.index.ordinal(doc_id)
+
+        return ordinal >= 0 and ordinal not in self.deleted
+
+    def live_doc_count(self):
+
+        return self.index.N - len(self.deleted)
+
+    def live_df(self, token):
+
+        deleted = self.deleted
+        postings = self.index.get_postings(token)
+        if postings is None: return 0
+        if not deleted: return len(postings)
+
+        if len(deleted) < len(postings):
+            return len(postings) - sum(1 for ordinal in deleted if postings.find(ordinal) >= 0)
+
+        return sum(1 for ordinal in postings.doc_ids if ordinal not in deleted)
+
+class GlobalDocFreqs:
+    """Live document frequency of a term summed over every segment."""
+
+    def __init__(self, segments):
+
+        self.segments = segments
+        self.cache = {}
+
+    def get(self, term, default = 0):
+
+        df = self.cache.get(term)
+
+        if df is None:
+            df = sum(segment.live_df(term) for segment in self.segments)
+            self.cache[term] = df
+
+        return df or default
+
+    def __len__(self):
+
+        return len({term for segment in self.segments for term in segment.index.term_ids})
+
+class SegmentedDocMap(Mapping):
+    """Doc id -> movie for the live version of each document."""
+
+    def __init__(self, segmented_index):
+
+        self.segmented_index = segmented_index
+
+    def __getitem__(self, doc_id):
+
+        for segment in reversed(self.segmented_index.segments):
+            if segment.has_live(doc_id):
+                return segment.index.docmap[doc_id]
+
+        raise KeyError(doc_id)
+
+    def __iter__(self):
+
+        for segment in list(self.segmented_index.segments):
+            deleted = segment.deleted
+            for ordinal, doc_id in enumerate(segment.index.doc_ids):
+                if ordinal not in deleted:
+                    yield doc_id
+
+    def __len__(self):
+
+        return sum(segment.live_doc_count() for segment in self.segmented_index.segments)
+
+class SegmentedIndex:
+    """Keyword index made of immutable segments with tombstones.
+
+    The base index built by `keyword_search_cli.py build` is the first
+    segment. add_documents/delete_documents write a small new segment or
+    tombstones instead of rebuilding, queries run over every live segment
+    with collection statistics summed across them (so scores match a full
+    rebuild), and merge() compacts all segments into one, optionally on a
+    background thread.
+    """
+
+    def __init__(self, stopwords, stemmer):
+
+        self.stopwords = stopwords
+        self.stemmer = stemmer
+        self.analyzer = Analyzer(stopwords, stemmer)
+        self.segments = []
+        self.next_segment = 1
+        self.lock = threading.RLock()
+        self.merge_lock = threading.Lock()
+        self.merge_thread = None
+        self.docmap = SegmentedDocMap(self)
+        self.__stats_cache = None
+        self.loaded_stamp = None
+        self.last_search_stats = {}
+
+    def tokenizer(self, text):
+
+        return self.analyzer.analyze(text)
+
+    def __new_index(self):
+
+        return InvertedIndex(self.stopwords, self.stemmer, self.analyzer)
+
+    def __open_segment(self, path, tombstones = ()):
+
+        index = self.__new_index()
+        index.load(path)
+
+        return Segment(path, index, tombstones)
+
+    def load(self):
+
+        with self.lock:
+
+            if os.path.exists(MANIFEST_PATH):
+
+                with open(MANIFEST_PATH, "r") as f:
+                    manifest = json.load(f)
+
+                self.next_segment = manifest["next_segment"]
+                self.segments = [
+                        self.__open_segment(entry["path"], entry["tombstones"])
+                        for entry in manifest["segments"]
+                        ]
+            else:
+
+                self.segments = [self.__open_segment(INDEX_PATH)]
+
+            self.__stats_cache = None
+            self.loaded_stamp = self.__source_stamp()
+
+    def __source_stamp(self):
+
+        path = MANIFEST_PATH if os.path.exists(MANIFEST_PATH) else INDEX_PATH
+        if not os.path.exists(path): return None
+
+        st = os.stat(path)
+
+        return (path, st.st_size, st.st_mtime_ns)
+
+    def refresh(self):
+        """Reload if another process changed the manifest or base index since load()."""
+
+        if self.__source_stamp() != self.loaded_stamp:
+            self.load()
+
+    def __save_manifest(self):
+
+        os.makedirs(SEGMENTS_DIR, exist_ok = True)
+
+        manifest = {
+                "next_segment": self.next_segment,
+                "segments": [
+                    {"path": segment.path, "tombstones": sorted(segment.tombstones)}
+                    for segment in self.segments
+                    ],
+                }
+
+        tmp_path = f"{MANIFEST_PATH}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, MANIFEST_PATH)
+
+        self.__stats_cache = None
+        self.loaded_stamp = self.__source_stamp()
+
+    def __segment_path(self):
+
+        path = os.path.join(SEGMENTS_DIR, f"segment_{self.next_segment:06d}.bin")
+        self.next_segment += 1
+
+        return path
+
+    def add_documents(self, movies):
+        """Add or replace movies by writing them as one new segment."""
+
+        if not movies: return
+
+        with self.lock:
+
+            index = self.__new_index()
+            index.build(movies, positional = self.positional())
+
+            path = self.__segment_path()
+            index.save(path)
+
+            for segment in self.segments:
+                for movie in movies:
+                    if segment.has_live(movie["id"]):
+                        segment.delete(movie["id"])
+
+            self.segments.append(self.__open_segment(path))
+            self.__save_manifest()
+
+        if len(self.segments) >= MAX_SEGMENTS:
+            self.merge(background = True)
+
+    def positional(self):
+
+        return bool(self.segments) and all(segment.index.positional for segment in self.segments)
+
+    def update_documents(self, movies):
+
+        self.add_documents(movies)
+
+    def delete_documents(self, doc_ids):
+
+        with self.lock:
+
+            deleted = 0
+            for doc_id in doc_ids:
+                for segment in self.segments:
+                    if segment.has_live(doc_id):
+                        segment.delete(doc_id)
+                        deleted += 1
+
+            self.__save_manifest()
+
+        return deleted
+
+    def global_stats(self):
+        """(live segments, CollectionStats of each under the statistics summed over all of them)."""
+
+        with self.lock:
+
+            if self.__stats_cache is not None:
+                return self.__stats_cache
+
+            segments = list(self.segments)
+            N = sum(segment.live_doc_count() for segment in segments)
+            non_empty = sum(segment.non_empty for segment in segments)
+            length_sum = sum(segment.length_sum for segment in segments)
+            avg_doc_length = length_sum / float(non_empty) if non_empty else 0.0
+            doc_freqs = GlobalDocFreqs(segments)
+
+            segment_stats = [
+                    CollectionStats(doc_freqs, segment.index.doc_lengths, N,
+                                    avg_doc_length = avg_doc_length, precompute_norms = False)
+                    for segment in segments
+                    ]
+
+            self.__stats_cache = (segments, segment_stats)
+
+            return self.__stats_cache
+
+    def bm25_search(self, query, limit, exhaustive = False):
+
+        results, self.last_search_stats = self.bm25_search_with_stats(query, limit, exhaustive)
+
+        return results
+
+    def bm25_search_with_stats(self, query, limit, exhaustive = False):
+        """(bm25_search results, their search stats), without touching last_search_stats.
+
+        Safe to call from several threads at once, e.g. by the search server.
+        """
+
+        query_tokens, phrases = parse_query(self.analyzer, query)
+        if len(query_tokens) == 0: raise Exception("too few tokens")
+
+        segments, segment_stats = self.global_stats()
+
+        results = []
+        scored = 0
+        skipped = 0
+        phrases_ignored = False
+        for segment, stats in zip(segments, segment_stats):
+
+            segment_results, search_stats = segment.index.search_tokens_with_stats(
+                query_tokens, limit, stats = stats, deleted = segment.deleted, exhaustive = exhaustive,
+                phrases = phrases)
+            results.extend(segment_results)
+
+            scored += search_stats["postings_scored"]
+            skipped += search_stats["postings_skipped"]
+            phrases_ignored |= search_stats["phrases_ignored"]
+
+        results.sort(key = lambda a: (-a[1], a[0]))
+
+        return results[:limit], {
+                "postings_scored": scored,
+                "postings_skipped": skipped,
+                "phrases_ignored": phrases_ignored,
+                }
+
+    def merge(self, background = False):
+
+        if background:
+
+            with self.lock:
+                if self.merge_thread is not None and self.merge_thread.is_alive():
+                    return self.merge_thread
+
+                self.merge_thread = threading.Thread(target = self.__merge, daemon = True)
+                self.merge_thread.start()
+
+                return self.merge_thread
+
+        self.__merge()
+
+    def wait_for_merge(self):
+
+        if self.merge_thread is not None:
+            self.merge_thread.join()
+
+    def __merge(self):
+
+        with self.merge_lock:
+            self.__merge_locked()
+
+    def __merge_locked(self):
+
+        with self.lock:
+            merging = list(self.segments)
+            snapshot = [set(segment.deleted) for segment in merging]
+            merged_tombstones = [set(segment.tombstones) for segment in merging]
+
+        if len(merging) < 2 and not any(snapshot): return
+
+        index = merge_segments(self.__new_index(), merging, snapshot)
+
+        with self.lock:
+
+            path = self.__segment_path()
+            index.save(path)
+
+            # Carry over deletes that landed while the merge was running.
+            merged = self.__open_segment(path)
+            for segment, tombstones in zip(merging, merged_tombstones):
+                for doc_id in segment.tombstones - tombstones:
+                    if merged.has_live(doc_id):
+                        merged.delete(doc_id)
+
+            self.segments = [merged] + self.segments[len(merging):]
+            self.__save_manifest()
+
+        for segment in merging:
+            if os.path.dirname(segment.path) == SEGMENTS_DIR and os.path.exists(segment.path):
+                os.remove(segment.path)
+
+def merge_segments(index, segments, deleted):
+    """Build `index` from the live documents of `segments` without re-tokenizing.
+
+    `deleted[i]` is the set of doc ordinals to drop from `segments[i]`.
+    Postings are copied term by term with their ordinals renumbered.
+    """
+
+    live = []
+    for seg_num, segment in enumerate(segments):
+        for ordinal, doc_id in enumerate(segment.index.doc_ids):
+            if ordinal not in deleted[seg_num]:
+                live.append((doc_id, seg_num, ordinal))
+    live.sort()
+
+    renumber = [{} for _ in segments]
+    docs = []
+    doc_lengths = array("d")
+    for new_ordinal, (doc_id, seg_num, ordinal) in enumerate(live):
+
+        renumber[seg_num][ordinal] = new_ordinal
+        docs.append(segments[seg_num].index.docmap[doc_id])
+        doc_lengths.append(segments[seg_num].index.doc_lengths[ordinal])
+
+    positional = bool(segments) and all(segment.index.positional for segment in segments)
+
+    term_postings = {}
+    for seg_num, segment in enumerate(segments):
+
+        mapping = renumber[seg_num]
+        for term, term_id in segment.index.term_ids.items():
+
+            postings = segment.index.postings[term_id]
+            merged = None
+            for i, (ordinal, tf) in enumerate(zip(postings.doc_ids, postings.tfs)):
+
+                new_ordinal = mapping.get(ordinal)
+                if new_ordinal is None: continue
+
+                if merged is None:
+                    merged = term_postings.get(term)
+                    if merged is None:
+                        merged = term_postings[term] = PostingList.positional() if positional else PostingList()
+                merged.append(new_ordinal, tf, postings.positions_at(i) if positional else None)
+
+    index.build_from_postings(docs, doc_lengths, term_postings, positional)
+
+    return index
+
+def clear_segments():
+
+    if not os.path.isdir(SEGMENTS_DIR): return
+
+    for name in os.listdir(SEGMENTS_DIR):
+        os.remove(os.path.join(SEGMENTS_DIR, name))
@@ -1,47 +1,126 @@
-from sentence_transformers import SentenceTransformer
 import string
 import json
 import os
 import re
+import time
 import numpy as np
+from .ranking import top_k_indices
+from .ann_index import IVFIndex, DEFAULT_NPROBE, file_stamp
+from .quantization import load_or_quantize, rescore
+from .embedding_cache import EmbeddingCache, texts_digest, read_digest, write_digest
+from .embedding_build import encode_texts, encoder_pool, clear_checkpoints
+from .chunk_pipeline import ChunkPipeline, iter_chunks
+from .query_cache import QueryEmbeddingCache, query_cache_path
+from .model_registry import registry, get_model, BI_ENCODER_MODEL, CLIP_MODEL, CROSS_ENCODER_MODEL
+
+MOVIE_EMBEDDINGS_PATH = "cache/movie_embeddings.npy"
+CHUNK_EMBEDDINGS_PATH = "cache/chunk_embeddings.npy"
+CHUNK_METADATA_PATH = "cache/chunk_metadata.npy"
+LEGACY_CHUNK_METADATA_PATH = "cache/chunk_metadata.json"
+CHUNK_IVF_PATH = "cache/chunk_ivf.npz"
+
+# Quantized searches re-score this many candidates per requested result
+# at full precision.
+RESCORE_FACTOR = 10
+
+# Rows whose norms are checked to tell a normalized cache from an old raw one.
+NORM_SAMPLE = 64
+
+# start and end are the chunk's character offsets into the movie description.
+CHUNK_METADATA_DTYPE = np.dtype([("movie_idx", np.int32), ("chunk_idx", np.int32), ("total_chunks", np.int32),
+                                 ("start", np.int32), ("end", np.int32)])
+
+# Whitespace after a sentence's closing punctuation; chunks split on it.
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+")
+
+# sem_chunk settings for chunk embeddings: sentences per chunk and overlap.
+CHUNK_SENTENCES = 4
+CHUNK_OVERLAP = 1
+
+# Entries of one rows x queries score matrix in a batched search; larger
+# query batches are scored in several products.
+SCORE_BLOCK_CELLS = 1 << 24
 
 class SemanticSearch:
 
-    def __init__(self, model_name):
+    def __init__(self, model_name = BI_ENCODER_MODEL, quantization = None, persist_query_cache = False):
 
-        self.model = SentenceTransformer(model_name) 
+        # Loaded now, so the first query does not pay for it.
+        get_model(model_name)
+        self.model_name = model_name
+        self.quantization = quantization
+        self.query_cache = QueryEmbeddingCache(
+                persist_path = query_cache_path(model_name) if persist_query_cache else None)
         self.embeddings = None
+        self.normalized_embeddings = None
+        self.quantized_embeddings = None
         self.documents = None
         self.document_map = {}
 
+    @property
+    def model(self):
+
+        # Looked up on each use rather than held: a model the registry evicts
+        # is freed once in-flight calls finish, and is never loaded twice.
+        return get_model(self.model_name)
+
     def generate_embeddings(self, text):
 
         if not text.strip(string.whitespace):
 
             raise ValueError("String was empty or contained only whitespace")
-        embedding = self.model.encode([text])
-        
-        return embedding[0]
+
+        # Repeat queries are answered from the cache without running the model.
+        return self.query_cache.get(text, self.__encode_query)
+
+    def __encode_query(self, text):
+
+        return self.model.encode([text])[0]
     
-    def build_embeddings(self, documents):
+    def build_embeddings(self, documents, workers = 1):
 
         print("building")
 
-        doc_list = []
+        doc_list = [movie_text(v) for v in documents]
 
-        for v in documents:
+        embeddings = self.encode_cached(doc_list, "movies", workers)
 
-            doc_list.append(f"{v["title"]}: {v["description"]}")
+        self.set_embeddings(save_embeddings(MOVIE_EMBEDDINGS_PATH, embeddings))
+        write_digest("movie_embeddings", texts_digest(self.model_name, doc_list))
 
-        self.embeddings = self.model.encode(doc_list, show_progress_bar = True)
-        
-        with open("cache/movie_embeddings.npy", "wb") as f_embed:
+        return self.embeddings
 
-            np.save(f_embed, self.embeddings)
+    def encode_cached(self, texts, kind, workers = 1):
+        """Embed `texts`, only running the model on ones not cached for it."""
 
-        return self.embeddings
+        cache = EmbeddingCache(self.model_name, kind)
+        embeddings = cache.encode(texts, lambda missing: encode_texts(self.model_name, missing, workers,
+                                                                      model = self.model, label = kind))
+
+        stats = cache.last_stats
+        print(f"{stats["encoded"]} texts encoded, {stats["cached"]} reused from the embedding cache")
+
+        return embeddings
+
+    def set_embeddings(self, embeddings):
+        """Use L2-normalized `embeddings`, plus their quantized copy if enabled."""
+
+        self.embeddings = embeddings
+        self.normalized_embeddings = embeddings
+
+        if self.quantization:
+            self.quantized_embeddings = load_or_quantize(
+                    MOVIE_EMBEDDINGS_PATH, len(embeddings), lambda: embeddings, self.quantization)
+        else:
+            self.quantized_embeddings = None
+
+    def set_quantization(self, quantization):
+
+        self.quantization = quantization
+        if self.embeddings is not None:
+            self.set_embeddings(self.embeddings)
     
-    def load_or_create_embeddings(self, documents):
+    def load_or_create_embeddings(self, documents, workers = 1):
 
         self.documents = documents
 
@@ -49,86 +128,179 @@ class SemanticSearch:
 
             self.document_map[doc["id"]] = doc
 
-        if os.path.exists("cache/movie_embeddings.npy"):
+        digest = texts_digest(self.model_name, [movie_text(v) for v in documents])
 
-            print("loading embeddings from file")
-            self.embeddings = np.load("cache/movie_embeddings.npy")
+        if os.path.exists(MOVIE_EMBEDDINGS_PATH) and read_digest("movie_embeddings") == digest:
 
-        if len(self.embeddings) == len(documents):
+            print("loading embeddings from file")
+            self.set_embeddings(load_embeddings(MOVIE_EMBEDDINGS_PATH))
 
             return self.embeddings
         else:
 
-            return self.build_embeddings(documents)
+            return self.build_embeddings(documents, workers)
 
     def search(self, query, limit):
 
-        if len(self.embeddings) == 0:
+        return self.__search_many([query], limit)[0]
+
+    def search_many(self, queries, limit):
+        """search() for every query, encoded in one batch and scored as one matrix product."""
+
+        return self.__search_many(queries, limit)
+
+    def __search_many(self, queries, limit):
+
+        if self.embeddings is None or len(self.embeddings) == 0:
 
             raise ValueError("No embeddings loaded. Call `load_or_create_embeddings` first.")
 
-        query_embedding = self.generate_embeddings(query)
+        if not queries: return []
+
+        query_embeddings = normalize_rows(self.generate_embeddings_many(queries))
+        vectors = self.quantized_embeddings if self.quantization else self.normalized_embeddings
 
-        scores_list = []
+        results = []
+
+        for start, block_scores in score_blocks(vectors, query_embeddings):
+
+            for col in range(block_scores.shape[1]):
+
+                query_embedding = query_embeddings[start + col]
+                scores = block_scores[:, col]
+
+                if self.quantization:
+                    ids, scores = rescore(scores, None, self.embeddings, query_embedding, limit * RESCORE_FACTOR)
+                else:
+                    ids = None
+
+                ret_list = []
 
-        for i in range(len(self.embeddings)):
+                for i in top_k_indices(scores, limit):
 
-            curr_score = cosine_similarity(query_embedding, self.embeddings[i])
-            scores_list.append((curr_score, self.documents[i]))
+                    doc = self.documents[ids[i] if ids is not None else i]
+                    ret_list.append({"score": scores[i], "title": doc["title"], "description": doc["description"]})
 
-        scores_list.sort(key = lambda a: a[0], reverse = True)
+                results.append(ret_list)
 
-        ret_list = []
+        return results
 
-        for (score, doc) in scores_list[:limit]:
+    def generate_embeddings_many(self, texts):
+        """Embeddings for `texts`, running the model once for all uncached ones."""
 
-            ret_list.append({"score": score, "title": doc["title"], "description": doc["description"]})
+        for text in texts:
+            if not text.strip(string.whitespace):
+                raise ValueError("String was empty or contained only whitespace")
 
-        return ret_list
+        return np.stack(self.query_cache.get_many(texts, self.__encode_queries))
+
+    def __encode_queries(self, texts):
+
+        return self.model.encode(texts)
 
 class ChunkedSemanticSearch(SemanticSearch):
 
-    def __init__(self, model_name = "all-MiniLM-L6-v2") -> None:
-        super().__init__(model_name)
+    def __init__(self, model_name = BI_ENCODER_MODEL, quantization = None, persist_query_cache = False) -> None:
+        super().__init__(model_name, quantization, persist_query_cache)
         self.chunk_embeddings = None
+        self.normalized_chunk_embeddings = None
+        self.quantized_chunk_embeddings = None
         self.chunk_metadata = None
+        self.chunk_movie_idx = None
+        self.chunk_starts = None
+        self.ann_index = None
 
-    def build_chunk_embeddings(self, documents):
+    def build_chunk_embeddings(self, documents, workers = 1):
 
         print("building")
 
-        chunk_list = []
-        metadata_list = []
+        executor = encoder_pool(self.model_name, workers)
 
-        for movie_idx, v in enumerate(documents):
-            if not v.get("description") or not v["description"].strip():
-                continue
+        def chunk_rows(text):
+
+            return [(start, end, chunk_text(text, start, end))
+                    for start, end in semantic_chunk_spans(text, CHUNK_SENTENCES, CHUNK_OVERLAP)]
+
+        def encode(texts):
 
-            text = v["description"]
-            
-            chunks = sem_chunk(text, 4, 1)
+            return encode_texts(self.model_name, texts, workers, model = self.model, label = "chunks",
+                                executor = executor, verbose = False, keep_checkpoint = True)
 
-            chunk_list.extend(chunks)
+        # Documents stream through chunking, encoding and writing; the whole
+        # catalog's chunks are never held in memory at once.
+        try:
+            pipeline = ChunkPipeline(encode, EmbeddingCache(self.model_name, "chunks"), normalize_rows)
+            rows = iter_chunks(documents, chunk_rows)
+            embeddings, metadata = pipeline.run(rows, CHUNK_EMBEDDINGS_PATH, CHUNK_METADATA_PATH, CHUNK_METADATA_DTYPE)
+        finally:
+            if executor is not None:
+                executor.shutdown()
 
-            for chunk_idx_in_doc, _ in enumerate(chunks):
-                metadata_list.append({
-                    "movie_idx": movie_idx,
-                    "chunk_idx": chunk_idx_in_doc,
-                    "total_chunks": len(chunks)
-                })
-        self.chunk_embeddings = self.model.encode(chunk_list, show_progress_bar = True)
-        self.chunk_metadata = metadata_list
-        
-        with open("cache/chunk_embeddings.npy", "wb") as f_embed:
+        clear_checkpoints()
+        write_digest("chunk_embeddings", self.chunk_digest(documents))
 
-            np.save(f_embed, self.chunk_embeddings)
+        self.set_chunk_embeddings(embeddings, metadata)
 
-        with  open("cache/chunk_metadata.json", "w") as f:
-            json.dump({"chunks": self.chunk_metadata, "total_chunks": len(chunk_list)}, f, indent=2)
+        self.build_ann_index()
 
         return self.chunk_embeddings
 
-    def load_or_create_chunk_embeddings(self, documents: list[dict]) -> np.ndarray:
+    def build_ann_index(self):
+
+        self.ann_index = IVFIndex.build(self.chunk_vectors(), source_stamp = chunk_embeddings_stamp())
+        self.ann_index.save(CHUNK_IVF_PATH)
+
+        return self.ann_index
+
+    def get_ann_index(self):
+        """The IVF index over the chunk embeddings, loaded or built on first use.
+
+        A saved index is reused only if it was built from the current
+        chunk embeddings file.
+        """
+
+        if self.ann_index is None and os.path.exists(CHUNK_IVF_PATH):
+
+            ann_index = IVFIndex.load(CHUNK_IVF_PATH)
+            stamp = chunk_embeddings_stamp()
+            if stamp is not None and ann_index.source_stamp == stamp and ann_index.num_vectors == len(self.chunk_embeddings):
+                self.ann_index = ann_index
+
+        if self.ann_index is None:
+            self.build_ann_index()
+
+        return self.ann_index
+
+    def set_chunk_embeddings(self, embeddings, metadata):
+        """Use L2-normalized chunk `embeddings` and their CHUNK_METADATA_DTYPE rows."""
+
+        self.chunk_embeddings = embeddings
+        self.normalized_chunk_embeddings = embeddings
+
+        if self.quantization:
+            self.quantized_chunk_embeddings = load_or_quantize(
+                    CHUNK_EMBEDDINGS_PATH, len(embeddings), lambda: embeddings, self.quantization)
+        else:
+            self.quantized_chunk_embeddings = None
+
+        # Chunks are stored grouped by movie, in movie order.
+        self.chunk_metadata = metadata
+        self.chunk_movie_idx = metadata["movie_idx"]
+        self.chunk_starts = segment_starts(self.chunk_movie_idx)
+        self.ann_index = None
+
+    def set_quantization(self, quantization):
+
+        super().set_quantization(quantization)
+        if self.chunk_embeddings is not None:
+            self.set_chunk_embeddings(self.chunk_embeddings, self.chunk_metadata)
+
+    def chunk_vectors(self):
+        """The matrix a chunk search scores first: normalized or quantized."""
+
+        return self.quantized_chunk_embeddings if self.quantization else self.normalized_chunk_embeddings
+
+    def load_or_create_chunk_embeddings(self, documents: list[dict], workers: int = 1) -> np.ndarray:
 
         self.documents = documents
 
@@ -136,72 +308,159 @@ class ChunkedSemanticSearch(SemanticSearch):
 
             self.document_map[doc["id"]] = doc
 
-        if os.path.exists("cache/chunk_embeddings.npy") and os.path.exists("cache/chunk_metadata.json"):
+        fresh = read_digest("chunk_embeddings") == self.chunk_digest(documents)
+        metadata = load_chunk_metadata(documents) if fresh else None
+
+        if os.path.exists(CHUNK_EMBEDDINGS_PATH) and metadata is not None and fresh:
 
             print("loading embeddings from file")
-            self.chunk_embeddings = np.load("cache/chunk_embeddings.npy")
-            with open("cache/chunk_metadata.json", "r") as f:
-                self.chunk_metadata = json.load(f)["chunks"]
+            self.set_chunk_embeddings(load_embeddings(CHUNK_EMBEDDINGS_PATH), metadata)
 
             return self.chunk_embeddings
         else:
 
-            return self.build_chunk_embeddings(documents)
+            return self.build_chunk_embeddings(documents, workers)
+
+    def chunk_digest(self, documents):
+
+        return texts_digest(f"{self.model_name}:{CHUNK_SENTENCES}:{CHUNK_OVERLAP}",
+                            [v.get("description") or "" for v in documents])
+
+    def search_chunks(self, query: str, limit: int = 10, nprobe: int = None):
+        """Top movies by best chunk score.
+
+        With `nprobe` only the chunks in the query's nprobe closest IVF
+        lists are scored; without it every chunk is (exact search). With
+        quantization the best candidates of the quantized pass are
+        re-scored from the full-precision embeddings.
+        """
+
+        return self.search_many([query], limit, nprobe)[0]
+
+    def search_many(self, queries, limit = 10, nprobe = None):
+        """search_chunks() for every query.
+
+        Queries are encoded in one batch. An exact search scores a block of
+        them with a single chunks x queries matrix product and folds chunk
+        scores into movie scores for all of them with one np.maximum.at.
+        """
+
+        if not queries: return []
+
+        query_embeddings = normalize_rows(super().generate_embeddings_many(queries))
+        vectors = self.chunk_vectors()
+
+        if nprobe:
+            ann_index = self.get_ann_index()
+            return [self.__candidate_results(*ann_index.search(q, vectors, nprobe), q, limit)
+                    for q in query_embeddings]
+
+        results = []
+
+        for start, chunk_scores in score_blocks(vectors, query_embeddings):
+
+            if self.quantization:
+                results.extend(self.__candidate_results(None, chunk_scores[:, col], query_embeddings[start + col], limit)
+                               for col in range(chunk_scores.shape[1]))
+                continue
+
+            # A movie scores as its best chunk: one max per movie's run of chunks.
+            movie_scores = segment_max(chunk_scores, self.chunk_starts)
 
-    def search_chunks(self, query: str, limit: int = 10):
+            results.extend(self.__movie_results(None, chunk_scores[:, col], self.chunk_starts, movie_scores[:, col], limit)
+                           for col in range(chunk_scores.shape[1]))
 
-        query_embedding = super().generate_embeddings(query)
+        return results
 
-        chunk_score_list = []
-        chunk_idx = 0
-        
-        for embedding in self.chunk_embeddings:
+    def __candidate_results(self, chunk_ids, chunk_scores, query_embedding, limit):
 
-            sim = cosine_similarity(embedding, query_embedding)
-            movie_idx = self.chunk_metadata[chunk_idx]["movie_idx"]
-            chunk_score_list.append(
-                                    {"chunk_idx": chunk_idx, 
-                                     "movie_idx": movie_idx, 
-                                     "score": sim
-                                    }
-                                   )
-            chunk_idx += 1
+        if self.quantization:
+            chunk_ids, chunk_scores = rescore(chunk_scores, chunk_ids, self.chunk_embeddings,
+                                              query_embedding, limit * RESCORE_FACTOR)
+        else:
+            order = np.argsort(chunk_ids)
+            chunk_ids, chunk_scores = chunk_ids[order], chunk_scores[order]
 
-        movie_score_dict = {}
-        for chunk_score in chunk_score_list:
+        starts = segment_starts(self.chunk_movie_idx[chunk_ids])
 
-            curr_movie_idx = chunk_score["movie_idx"]
-            curr_score = chunk_score["score"]
+        return self.__movie_results(chunk_ids, chunk_scores, starts, segment_max(chunk_scores, starts), limit)
 
-            if curr_movie_idx not in movie_score_dict or movie_score_dict[curr_movie_idx] < curr_score:
-                movie_score_dict[curr_movie_idx] = curr_score 
+    def __movie_results(self, chunk_ids, chunk_scores, starts, movie_scores, limit):
+        """Results for the top movies, each with the chunk that gave it its score.
 
-        sort_movies = sorted(movie_score_dict.items(), key = lambda a: a[1], reverse = True)
+        `starts` splits the (ascending) chunk rows into one run per movie
+        and `movie_scores` holds each run's max.
+        """
 
+        ends = np.append(starts[1:], len(chunk_scores))
         results = []
 
-        for movie_idx, score in sort_movies:
-            curr_movie = self.documents[movie_idx]
-            res = format_search_result(curr_movie["id"], curr_movie["title"], curr_movie["description"][:100], score)
+        for seg in top_k_indices(movie_scores, limit):
+
+            row = starts[seg] + int(np.argmax(chunk_scores[starts[seg]:ends[seg]]))
+            chunk_meta = self.chunk_metadata[chunk_ids[row] if chunk_ids is not None else row]
+
+            curr_movie = self.documents[chunk_meta["movie_idx"]]
+            res = format_search_result(curr_movie["id"], curr_movie["title"], curr_movie["description"][:100],
+                                       movie_scores[seg], chunk_idx = int(chunk_meta["chunk_idx"]),
+                                       total_chunks = int(chunk_meta["total_chunks"]),
+                                       passage = self.chunk_passage(chunk_meta))
             results.append(res)
 
-        return results[:limit]
+        return results
+
+    def chunk_passage(self, chunk_meta):
+        """Text of the chunk a CHUNK_METADATA_DTYPE row describes."""
+
+        text = self.documents[chunk_meta["movie_idx"]]["description"]
+
+        return chunk_text(text, int(chunk_meta["start"]), int(chunk_meta["end"]))
+
+    def ann_recall(self, queries, limit = 10, nprobe = DEFAULT_NPROBE):
+        """Mean fraction of the exact top-`limit` movies the IVF search also returns."""
+
+        recalls = []
+        for exact, approx in zip(self.search_many(queries, limit), self.search_many(queries, limit, nprobe)):
+
+            exact = {res["id"] for res in exact}
+            approx = {res["id"] for res in approx}
 
-def search_chunked(query, limit):
+            if exact:
+                recalls.append(len(exact & approx) / len(exact))
+
+        return sum(recalls) / len(recalls) if recalls else 1.0
+
+def search_chunked(query, limit, nprobe = None, quantization = None):
 
     movies = []
     with open("data/movies.json", "r") as f:
         data = json.load(f)
         movies = data["movies"]
-    sem_search = ChunkedSemanticSearch()
+    sem_search = ChunkedSemanticSearch(quantization = quantization, persist_query_cache = True)
 
     embeddings = sem_search.load_or_create_chunk_embeddings(movies)
 
-    results = sem_search.search_chunks(query, limit)
-    for i, res in enumerate(results, 1):
-        print(f"\n{i}. {res['title']} (score: {res['score']:.4f})")
-        print(f"   {res['document']}...")
+    return sem_search.search_chunks(query, limit, nprobe)
+
+def search_chunked_batch(queries_path, limit, nprobe = None, quantization = None):
+
+    with open("data/movies.json", "r") as f:
+        movies = json.load(f)["movies"]
 
+    with open(queries_path, "r") as f:
+        queries = [line.strip() for line in f if line.strip()]
+
+    sem_search = ChunkedSemanticSearch(quantization = quantization, persist_query_cache = True)
+    sem_search.load_or_create_chunk_embeddings(movies)
+
+    start = time.perf_counter()
+    batch_results = sem_search.search_many(queries, limit, nprobe)
+    elapsed = time.perf_counter() - start
+
+    for query, results in zip(queries, batch_results):
+        print(f"{query}: " + ", ".join(f"{res['title']} ({res['score']:.4f})" for res in results))
+
+    print(f"{len(queries)} queries in {elapsed:.3f}s ({len(queries) / max(elapsed, 1e-9):.0f} queries/s)")
 
 def format_search_result(
     doc_id: str, title: str, document: str, score: float, **metadata: any
@@ -226,15 +485,67 @@ def format_search_result(
         "metadata": metadata if metadata else {},
     }
 
-def embed_chunks():
+def ann_recall(limit, nprobe):
 
     movies = []
     with open("data/movies.json", "r") as f:
         data = json.load(f)
         movies = data["movies"]
-    sem_search = chunkedsemanticsearch()
+
+    with open("data/golden_dataset.json", "r") as f:
+        queries = [t["query"] for t in json.load(f)["test_cases"]]
+
+    sem_search = ChunkedSemanticSearch()
+    sem_search.load_or_create_chunk_embeddings(movies)
+
+    index = sem_search.get_ann_index()
+    recall = sem_search.ann_recall(queries, limit, nprobe)
+
+    print(f"IVF: {index.num_vectors} chunks in {index.nlist} lists, nprobe {nprobe}")
+    print(f"Recall@{limit} vs exact search over {len(queries)} queries: {recall:.4f}")
+
+def quantization_recall(limit, mode):
+
+    movies = []
+    with open("data/movies.json", "r") as f:
+        data = json.load(f)
+        movies = data["movies"]
+
+    with open("data/golden_dataset.json", "r") as f:
+        queries = [t["query"] for t in json.load(f)["test_cases"]]
+
+    sem_search = ChunkedSemanticSearch()
+    sem_search.load_or_create_chunk_embeddings(movies)
+    full_bytes = sem_search.normalized_chunk_embeddings.nbytes
+
+    exact = [[res["id"] for res in results] for results in sem_search.search_many(queries, limit)]
+
+    sem_search.set_quantization(mode)
+    quantized_bytes = sem_search.quantized_chunk_embeddings.nbytes
+
+    recalls = []
+    same_order = 0
+    for results, exact_ids in zip(sem_search.search_many(queries, limit), exact):
+
+        approx_ids = [res["id"] for res in results]
+        same_order += approx_ids == exact_ids
+        if exact_ids:
+            recalls.append(len(set(exact_ids) & set(approx_ids)) / len(exact_ids))
+
+    print(f"{mode}: {quantized_bytes / 1e6:.1f} MB vs {full_bytes / 1e6:.1f} MB float32 "
+          f"({full_bytes / quantized_bytes:.1f}x smaller)")
+    print(f"Recall@{limit} vs exact search over {len(queries)} queries: "
+          f"{sum(recalls) / len(recalls) if recalls else 1.0:.4f}, identical ranking for {same_order}")
+
+def embed_chunks(workers = 1):
+
+    movies = []
+    with open("data/movies.json", "r") as f:
+        data = json.load(f)
+        movies = data["movies"]
+    sem_search = ChunkedSemanticSearch()
     
-    embeddings = sem_search.load_or_create_chunk_embeddings(movies)
+    embeddings = sem_search.load_or_create_chunk_embeddings(movies, workers)
 
     print(f"Generated {len(embeddings)} chunked embeddings")
 
@@ -261,51 +572,169 @@ def chunk(text, chunk_size, overlap):
         i += (chunk_size - overlap)
 
 def sem_chunk(text, max_chunk_size, overlap):
-    text = text.strip()
 
-    if not text:
-        return []
+    chunks = semantic_chunks(text, max_chunk_size, overlap)
+
+    for i, chunk in enumerate(chunks, 1):
+        print(f"{i}. {chunk}")       
+    return chunks
+
+def semantic_chunks(text, max_chunk_size, overlap):
+    """Groups of up to `max_chunk_size` sentences, `overlap` shared between neighbours."""
+
+    return [chunk_text(text, start, end) for start, end in semantic_chunk_spans(text, max_chunk_size, overlap)]
 
-    sentences = re.split(r"(?<=[.!?])\s+", text)
-    n_sentences = len(sentences)
+def semantic_chunk_spans(text, max_chunk_size, overlap):
+    """(start, end) offsets into `text` of each chunk semantic_chunks() returns."""
 
-    if n_sentences == 1 and not sentences[0].endswith(('.', '?', '!')):
-        return sentences
+    start = len(text) - len(text.lstrip())
+    end = len(text.rstrip())
 
-    chunks = []
+    if start >= end:
+        return []
+
+    sentences = []
+    for sentence_break in SENTENCE_BREAK.finditer(text, start, end):
+        sentences.append((start, sentence_break.start()))
+        start = sentence_break.end()
+    sentences.append((start, end))
+
+    spans = []
     i = 0
-    while i < n_sentences: 
-        
-        current_slice = sentences[i : i + max_chunk_size]
+    while i < len(sentences):
 
-        chunk_sentences = [s.strip() for s in current_slice if s.strip()]
+        last = min(i + max_chunk_size, len(sentences)) - 1
+        spans.append((sentences[i][0], sentences[last][1]))
 
-        if chunk_sentences:
-            chunks.append(" ".join(chunk_sentences))
-        
         i += max_chunk_size - overlap
 
-    for i, chunk in enumerate(chunks, 1):
-        print(f"{i}. {chunk}")       
-    return chunks
+    return spans
 
-def search_query(query, limit):
+def chunk_text(text, start, end):
+    """The chunk at text[start:end], its sentences joined by single spaces."""
 
-    sem_search = SemanticSearch()
+    return SENTENCE_BREAK.sub(" ", text[start:end])
+
+def search_query(query, limit, quantization = None):
+
+    sem_search = SemanticSearch(quantization = quantization, persist_query_cache = True)
 
     documents = []
     with open("data/movies.json", "r") as f_movies:
         data = json.load(f_movies)
         documents = data["movies"]
     embeddings = sem_search.load_or_create_embeddings(documents)
-    res = sem_search.search(query, limit)
 
-    i = 1 
-    for d in res:
+    return sem_search.search(query, limit)
+
+
+def movie_text(doc):
 
-        print(f"{i}. {d["title"]}: ({d["score"]})\n   {d["description"]}\n")
-        i += 1
+    return f"{doc["title"]}: {doc["description"]}"
 
+def save_npy(path, array):
+    """Atomically write `array` to `path` and return a read-only memory map of it."""
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+    return np.load(path, mmap_mode = "r")
+
+def save_embeddings(path, embeddings):
+
+    return save_npy(path, normalize_rows(embeddings))
+
+def load_embeddings(path):
+    """Memory-map L2-normalized embeddings saved by save_embeddings.
+
+    Processes mapping the same file share one physical copy. A cache from
+    before embeddings were stored normalized is normalized and rewritten
+    once.
+    """
+
+    embeddings = np.load(path, mmap_mode = "r")
+
+    sample = embeddings[::max(1, len(embeddings) // NORM_SAMPLE)]
+    norms = np.linalg.norm(sample, axis = -1)
+    if not np.all((np.abs(norms - 1) < 1e-3) | (norms == 0)):
+        embeddings = save_embeddings(path, embeddings)
+
+    return embeddings
+
+def load_chunk_metadata(documents):
+    """Memory-mapped chunk metadata, converting an older cache once.
+
+    Metadata from an old JSON cache, or saved before chunk offsets were
+    stored, gets the offsets by re-chunking the `documents` it was built from.
+    """
+
+    if os.path.exists(CHUNK_METADATA_PATH):
+
+        metadata = np.load(CHUNK_METADATA_PATH, mmap_mode = "r")
+        if metadata.dtype == CHUNK_METADATA_DTYPE:
+            return metadata
+
+        chunks = [{name: int(m[name]) for name in ("movie_idx", "chunk_idx", "total_chunks")} for m in metadata]
+
+    elif os.path.exists(LEGACY_CHUNK_METADATA_PATH):
+
+        with open(LEGACY_CHUNK_METADATA_PATH, "r") as f:
+            chunks = json.load(f)["chunks"]
+
+    else:
+        return None
+
+    spans = {}
+    rows = []
+    for m in chunks:
+
+        movie_idx = m["movie_idx"]
+        if movie_idx not in spans:
+            spans[movie_idx] = semantic_chunk_spans(documents[movie_idx]["description"], CHUNK_SENTENCES, CHUNK_OVERLAP)
+
+        rows.append((movie_idx, m["chunk_idx"], m["total_chunks"]) + spans[movie_idx][m["chunk_idx"]])
+
+    return save_npy(CHUNK_METADATA_PATH, np.array(rows, dtype = CHUNK_METADATA_DTYPE))
+
+def chunk_embeddings_stamp():
+
+    return file_stamp(CHUNK_EMBEDDINGS_PATH) if os.path.exists(CHUNK_EMBEDDINGS_PATH) else None
+
+def normalize_rows(matrix):
+    """L2-normalize a vector or each row of a matrix; zero rows stay zero."""
+
+    matrix = np.asarray(matrix, dtype = np.float32)
+    norms = np.linalg.norm(matrix, axis = -1, keepdims = True)
+
+    return matrix / np.where(norms == 0, 1, norms)
+
+def score_blocks(vectors, query_embeddings):
+    """(first query, rows x queries scores) for blocks of queries.
+
+    Each block is one matrix product, with the block sized so the score
+    matrix stays under SCORE_BLOCK_CELLS entries.
+    """
+
+    block = max(1, SCORE_BLOCK_CELLS // max(1, len(vectors)))
+
+    for start in range(0, len(query_embeddings), block):
+        yield start, vectors @ query_embeddings[start:start + block].T
+
+def segment_starts(segment_ids):
+    """Index where each run of equal values in `segment_ids` begins."""
+
+    if len(segment_ids) == 0: return np.zeros(0, dtype = np.int64)
+
+    return np.flatnonzero(np.r_[True, segment_ids[1:] != segment_ids[:-1]])
+
+def segment_max(scores, starts):
+    """Max of `scores` (rows, or rows x queries) over each run of rows beginning at `starts`."""
+
+    if len(starts) == 0: return np.zeros((0,) + scores.shape[1:], dtype = scores.dtype)
+
+    return np.maximum.reduceat(scores, starts, axis = 0)
 
 def cosine_similarity(vec1, vec2):
     dot_product = np.dot(vec1, vec2)
@@ -354,3 +783,16 @@ def verify_model():
 
     print(f"Model loaded: {sem_search.model}")
     print(f"Max sequence length: {sem_search.model.max_seq_length}")
+
+def warm_models(include_all = False):
+
+    models = [(BI_ENCODER_MODEL, "sentence_transformer")]
+    if include_all:
+        models += [(CLIP_MODEL, "sentence_transformer"), (CROSS_ENCODER_MODEL, "cross_encoder")]
+
+    registry.warm_up(models)
+
+    for m in registry.metrics():
+        print(f"{m["name"]} ({m["kind"]}): loaded in {m["load_seconds"]:.2f}s, "
+              f"warm-up {m.get("warm_up_seconds", 0.0):.2f}s, {m["memory_bytes"] / 1e6:.1f} MB, "
+              f"{"resident" if m["resident"] else "evicted"}")
@@ -0,0 +1,240 @@
+import heapq
+import json
+import os
+import multiprocessing
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from .keyword_search import InvertedIndex, CollectionStats, CACHE_DIR, parse_query
+from .analyzer import Analyzer
+from .index_file import IndexFile
+
+SHARDS_DIR = os.path.join(CACHE_DIR, "shards")
+SHARDS_MANIFEST_PATH = os.path.join(SHARDS_DIR, "manifest.json")
+
+def shard_of(doc_id, num_shards):
+
+    return doc_id % num_shards
+
+def _build_shard(path, movies, stopwords, stemmer, positional):
+
+    index = InvertedIndex(stopwords, stemmer)
+    index.build(movies, positional = positional)
+    index.save(path)
+
+    return list(zip(index.doc_ids, index.doc_lengths))
+
+def build_shards(movies, num_shards, stopwords, stemmer, positional = False):
+    """Partition `movies` by doc id into `num_shards` indexes and write them.
+
+    Every shard is built in its own process. The manifest records the
+    collection-wide N and average document length, computed in doc id
+    order exactly as a single index would, so sharded scores match it.
+    """
+
+    if num_shards < 1: raise Exception("need at least one shard")
+
+    partitions = [[] for _ in range(num_shards)]
+    for movie in movies:
+        partitions[shard_of(movie["id"], num_shards)].append(movie)
+
+    os.makedirs(SHARDS_DIR, exist_ok = True)
+    paths = [os.path.join(SHARDS_DIR, f"shard_{i:03d}.bin") for i in range(num_shards)]
+
+    with ProcessPoolExecutor(max_workers = num_shards) as pool:
+        shard_lengths = list(pool.map(_build_shard, paths, partitions,
+                                      [stopwords] * num_shards, [stemmer] * num_shards,
+                                      [positional] * num_shards))
+
+    doc_lengths = sorted(pair for lengths in shard_lengths for pair in lengths)
+    non_empty = [doc_len for _, doc_len in doc_lengths if doc_len]
+
+    manifest = {
+            "shards": paths,
+            "N": len(doc_lengths),
+            "avg_doc_length": sum(non_empty) / float(len(non_empty)) if non_empty else 0.0,
+            }
+
+    tmp_path = f"{SHARDS_MANIFEST_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, SHARDS_MANIFEST_PATH)
+
+    return manifest
+
+def _serve_shard(conn, path, stopwords, stemmer):
+    """Worker loop: own one shard and answer search requests over `conn`."""
+
+    index = InvertedIndex(stopwords, stemmer)
+
+    try:
+        index.load(path)
+    except Exception as e:
+        conn.send(("error", str(e)))
+        return
+
+    conn.send(("ready", None))
+
+    while True:
+
+        request = conn.recv()
+        if request is None: break
+
+        query_tokens, limit, doc_freqs, N, avg_doc_length, exhaustive, phrases = request
+
+        try:
+            stats = CollectionStats(doc_freqs, index.doc_lengths, N,
+                                    avg_doc_length = avg_doc_length, precompute_norms = False)
+            conn.send(("ok", index.search_tokens_with_stats(query_tokens, limit, stats = stats,
+                                                            exhaustive = exhaustive, phrases = phrases)))
+        except Exception as e:
+            conn.send(("error", str(e)))
+
+    conn.close()
+
+class ShardedDocMap(Mapping):
+    """Doc id -> movie, read from the owning shard's mapped file."""
+
+    def __init__(self, sharded_index):
+
+        self.sharded_index = sharded_index
+
+    def __getitem__(self, doc_id):
+
+        if not isinstance(doc_id, int): raise KeyError(doc_id)
+
+        shard_files = self.sharded_index.shard_files
+
+        return shard_files[shard_of(doc_id, len(shard_files))].docmap[doc_id]
+
+    def __iter__(self):
+
+        for shard_file in self.sharded_index.shard_files:
+            yield from shard_file.docmap
+
+    def __len__(self):
+
+        return sum(shard_file.num_docs for shard_file in self.sharded_index.shard_files)
+
+class ShardedIndex:
+    """Keyword index partitioned by doc id across worker processes.
+
+    Each shard is loaded by its own process. A query is tokenized once
+    here, its global document frequencies are summed from the shards'
+    mapped term tables, and it is broadcast to every worker together with
+    the collection-wide N and average length. Each worker returns its own
+    top-k and the lists are heap-merged, so results equal one big index.
+    """
+
+    def __init__(self, stopwords, stemmer):
+
+        self.stopwords = stopwords
+        self.stemmer = stemmer
+        self.analyzer = Analyzer(stopwords, stemmer)
+        self.shard_files = []
+        self.workers = []
+        self.N = 0
+        self.avg_doc_length = 0.0
+        self.docmap = ShardedDocMap(self)
+        self.last_search_stats = {}
+
+    def __enter__(self):
+
+        self.start()
+
+        return self
+
+    def __exit__(self, *exc):
+
+        self.close()
+
+    def start(self):
+
+        if not os.path.exists(SHARDS_MANIFEST_PATH):
+            raise Exception("no sharded index, run `keyword_search_cli.py shard` first")
+
+        with open(SHARDS_MANIFEST_PATH, "r") as f:
+            manifest = json.load(f)
+
+        self.N = manifest["N"]
+        self.avg_doc_length = manifest["avg_doc_length"]
+        self.shard_files = [IndexFile(path) for path in manifest["shards"]]
+
+        for path in manifest["shards"]:
+
+            conn, worker_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target = _serve_shard, daemon = True,
+                                              args = (worker_conn, path, self.stopwords, self.stemmer))
+            process.start()
+            worker_conn.close()
+            self.workers.append((process, conn))
+
+        for _, conn in self.workers:
+            status, message = conn.recv()
+            if status == "error":
+                self.close()
+                raise Exception(message)
+
+    def close(self):
+
+        for process, conn in self.workers:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            conn.close()
+
+        for process, _ in self.workers:
+            process.join()
+
+        self.workers = []
+
+    def doc_freqs(self, tokens):
+
+        return {
+                token: sum(shard_file.doc_freqs.get(token, 0) for shard_file in self.shard_files)
+                for token in set(tokens)
+                }
+
+    def bm25_search(self, query, limit, exhaustive = False):
+
+        query_tokens, phrases = parse_query(self.analyzer, query)
+        if len(query_tokens) == 0: raise Exception("too few tokens")
+        if not self.workers: raise Exception("sharded index is not started")
+
+        request = (query_tokens, limit, self.doc_freqs(query_tokens), self.N, self.avg_doc_length,
+                   exhaustive, phrases)
+
+        # Scatter to every shard before gathering so they score concurrently.
+        for _, conn in self.workers:
+            conn.send(request)
+
+        shard_results = []
+        errors = []
+        scored = 0
+        skipped = 0
+        phrases_ignored = False
+        for _, conn in self.workers:
+
+            status, payload = conn.recv()
+            if status == "error":
+                errors.append(payload)
+                continue
+
+            results, search_stats = payload
+            shard_results.append(results)
+            scored += search_stats["postings_scored"]
+            skipped += search_stats["postings_skipped"]
+            phrases_ignored |= search_stats["phrases_ignored"]
+
+        if errors: raise Exception(errors[0])
+
+        self.last_search_stats = {
+                "postings_scored": scored,
+                "postings_skipped": skipped,
+                "phrases_ignored": phrases_ignored,
+                }
+
+        merged = heapq.merge(*shard_results, key = lambda a: (-a[1], a[0]))
+
+        return list(islice(merged, limit))
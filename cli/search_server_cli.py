@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import argparse
+
+from lib.search_client import server_health, DEFAULT_HOST, DEFAULT_PORT
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident Search Server CLI")
+
+    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+    serve_parser = subparsers.add_parser("serve", help="Load indexes and models once and answer queries over HTTP")
+    serve_parser.add_argument("--host", type=str, default=DEFAULT_HOST, help=f"Address to bind (default {DEFAULT_HOST})")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default {DEFAULT_PORT})")
+
+    status_parser = subparsers.add_parser("status", help="Check whether a search server is running")
+
+    args = parser.parse_args()
+
+    match args.command:
+
+        case "serve":
+
+            from lib.search_server import serve
+            serve(args.host, args.port)
+
+        case "status":
+
+            try:
+                health = server_health()
+            except Exception as e:
+                print(e)
+                return
+
+            if health is None:
+                print("No search server running")
+                return
+
+            print(f"Search server up for {health["uptime"]:.0f}s")
+            for m in health["models"]:
+                print(f"  {m["name"]} ({m["kind"]}): {m["hits"]} hits, {m["memory_bytes"] / 1e6:.1f} MB")
+
+            cache = health["result_cache"]
+            print(f"Hybrid result cache: {cache["size"]} entries, {cache["hits"]} hits "
+                  f"({cache["disk_hits"]} from disk), {cache["misses"]} misses, "
+                  f"{cache["hit_rate"]:.0%} hit rate, {cache["seconds_saved"]:.1f}s saved")
+
+        case _:
+            parser.print_help()
+
+if __name__ == "__main__":
+    main()
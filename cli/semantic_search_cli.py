@@ -2,7 +2,24 @@
 
 import argparse
 
-from lib.semantic_search import verify_model, verify_embeddings, embed_text, embed_query_text, search_query, chunk, sem_chunk, embed_chunks, search_chunked
+from lib.semantic_search import verify_model, verify_embeddings, embed_text, embed_query_text, search_query, chunk, sem_chunk, embed_chunks, search_chunked, ann_recall, DEFAULT_NPROBE, quantization_recall
+from lib.semantic_search import warm_models, search_chunked_batch
+from lib.quantization import QUANTIZATION_MODES
+from lib.search_client import remote_call
+
+def print_results(results):
+
+    for i, d in enumerate(results, 1):
+
+        print(f"{i}. {d["title"]}: ({d["score"]})\n   {d["description"]}\n")
+
+def print_chunked_results(results):
+
+    for i, res in enumerate(results, 1):
+        print(f"\n{i}. {res['title']} (score: {res['score']:.4f})")
+        print(f"   {res['document']}...")
+        print(f"   best match, chunk {res['metadata']['chunk_idx'] + 1}/{res['metadata']['total_chunks']}: "
+              f"{res['metadata']['passage']}")
 
 def main():
     parser = argparse.ArgumentParser(description="Semantic Search CLI")
@@ -21,6 +38,8 @@ def main():
     search_parser.add_argument("query", type=str, help="Query to find embedding of")
     search_parser.add_argument("--limit", type=int, 
                               help="Optional limit to number of matches (default 5)", default=5)
+    search_parser.add_argument("--quantize", choices=QUANTIZATION_MODES,
+                               help="Scan quantized embeddings, then re-score the best at full precision")
 
     embed_query_parser = subparsers.add_parser("embedquery", help="Generate embedding for query")
     embed_query_parser.add_argument("query", type=str, help="Query to find embedding of")
@@ -36,11 +55,38 @@ def main():
     sem_chunk_parser.add_argument("--overlap", type=int, help="Number of sentence to overlap into the next chunk", default=0)
 
     embed_chunks_parser = subparsers.add_parser("embed_chunks", help="Generate embedding for chunks")
+    embed_chunks_parser.add_argument("--workers", type=int, default=1,
+                                     help="Encoder processes (default 1, 0 = one per CPU core)")
 
     sem_search_parser = subparsers.add_parser("search_chunked", help="Search semantically for query")
     sem_search_parser.add_argument("query", type=str, help="Query to find document of")
     sem_search_parser.add_argument("--limit", type=int, 
                               help="Optional limit to number of matches (default 5)", default=5)
+    sem_search_parser.add_argument("--nprobe", type=int, default=0,
+                                   help="Search only this many IVF lists (default 0 = exact search)")
+    sem_search_parser.add_argument("--quantize", choices=QUANTIZATION_MODES,
+                                   help="Scan quantized embeddings, then re-score the best at full precision")
+
+    search_batch_parser = subparsers.add_parser("search_batch",
+                                                help="Chunked search for every query in a file as one batch")
+    search_batch_parser.add_argument("queries", type=str, help="File with one query per line")
+    search_batch_parser.add_argument("--limit", type=int, help="Optional limit to number of matches (default 5)", default=5)
+    search_batch_parser.add_argument("--nprobe", type=int, default=0,
+                                     help="Search only this many IVF lists (default 0 = exact search)")
+    search_batch_parser.add_argument("--quantize", choices=QUANTIZATION_MODES,
+                                     help="Scan quantized embeddings, then re-score the best at full precision")
+
+    ann_recall_parser = subparsers.add_parser("ann_recall", help="Measure IVF recall against exact chunk search")
+    ann_recall_parser.add_argument("--limit", type=int, help="Recall cutoff (default 10)", default=10)
+    ann_recall_parser.add_argument("--nprobe", type=int, help="IVF lists to search", default=DEFAULT_NPROBE)
+
+    warm_parser = subparsers.add_parser("warm_models", help="Load and warm models, then print load metrics")
+    warm_parser.add_argument("--all", action="store_true", help="Also warm the CLIP and cross-encoder models")
+
+    quant_recall_parser = subparsers.add_parser("quant_recall",
+                                                help="Measure memory saved and recall lost by quantized search")
+    quant_recall_parser.add_argument("--mode", choices=QUANTIZATION_MODES, default="int8")
+    quant_recall_parser.add_argument("--limit", type=int, help="Recall cutoff (default 10)", default=10)
     args = parser.parse_args()
 
     match args.command:
@@ -63,7 +109,16 @@ def main():
 
         case "search":
 
-            search_query(args.query, args.limit)
+            try:
+                # A running search server answers from memory; quantized search is local only.
+                answer = None if args.quantize else remote_call(
+                        "semantic", {"query": args.query, "limit": args.limit, "chunked": False})
+                results = answer["results"] if answer is not None else search_query(args.query, args.limit, args.quantize)
+            except Exception as e:
+                print(e)
+                return
+
+            print_results(results)
 
         case "chunk":
 
@@ -75,11 +130,39 @@ def main():
 
         case "embed_chunks":
 
-            embed_chunks()
+            embed_chunks(args.workers)
 
         case "search_chunked":
 
-            search_chunked(args.query, args.limit)
+            try:
+                answer = None if args.quantize else remote_call(
+                        "semantic", {"query": args.query, "limit": args.limit, "nprobe": args.nprobe})
+                results = (answer["results"] if answer is not None
+                           else search_chunked(args.query, args.limit, args.nprobe, args.quantize))
+            except Exception as e:
+                print(e)
+                return
+
+            print_chunked_results(results)
+
+        case "search_batch":
+
+            try:
+                search_chunked_batch(args.queries, args.limit, args.nprobe, args.quantize)
+            except Exception as e:
+                print(e)
+
+        case "ann_recall":
+
+            ann_recall(args.limit, args.nprobe)
+
+        case "warm_models":
+
+            warm_models(args.all)
+
+        case "quant_recall":
+
+            quantization_recall(args.limit, args.mode)
 
         case _:
             parser.print_help()